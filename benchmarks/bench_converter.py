@@ -0,0 +1,162 @@
+#!/usr/local/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark suite for the converter's layouts, compared against stored baselines
+
+For each scale (precincts per county) a synthetic election is generated with
+generate_county_files.py, then the suite times:
+
+- each layout's path through the converter (process_excel_file for the
+  Contest Title, blank header and Table of Contents workbooks, and
+  process_csv_file for the SOS CSV);
+- process_election_directory over the whole folder.
+
+Times are the best of --repeat runs, each starting with an empty
+normalization memo so none of them reuses what an earlier one normalized.
+They're compared with
+benchmarks/baselines/converter.json, and any case slower than the baseline
+by more than --tolerance is reported as a regression (exit status 1).
+Baselines depend on the machine, so record your own before comparing:
+
+    python benchmarks/bench_converter.py --save-baseline
+    python benchmarks/bench_converter.py
+"""
+
+import os, sys
+import io
+import json
+import time
+import argparse
+import platform
+import tempfile
+import contextlib
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from convert_spreadsheets_to_csv import XLSProcessor, NormalizationMemo
+from generate_county_files import LAYOUTS, generate_election
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines', 'converter.json')
+
+
+def main():
+    args = parseArguments()
+
+    timings = {}
+    for scale in args.scales:
+        timings.update(time_scale(scale, args.contests, args.countiesPerLayout, args.repeat))
+
+    if args.saveBaseline:
+        save_baseline(args.baseline, timings, args)
+        print(f"Baseline saved to {args.baseline}")
+        return
+
+    baseline = load_baseline(args.baseline)
+    regressions = report(timings, baseline, args.tolerance)
+
+    if regressions:
+        print(f"{len(regressions)} case(s) slower than the baseline by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+def parseArguments():
+    parser = argparse.ArgumentParser(description='Benchmark the converter on synthetic elections')
+    parser.add_argument('--scales', type=lambda value: [int(scale) for scale in value.split(',')], default=[25, 100, 400],
+                        help='comma-separated precincts per county (default: 25,100,400)')
+    parser.add_argument('--contests', type=int, default=14, help='contests per county (default: 14)')
+    parser.add_argument('--counties-per-layout', dest='countiesPerLayout', type=int, default=2,
+                        help='county files of each layout in the election folder (default: 2)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='fraction slower than the baseline that counts as a regression (default: 0.5)')
+    parser.add_argument('--baseline', type=str, default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', dest='saveBaseline', action='store_true',
+                        help='record these timings as the new baseline instead of comparing')
+
+    return parser.parse_args()
+
+
+def time_scale(scale, contests, countiesPerLayout, repeat):
+    """Times every layout and the whole election directory at one scale"""
+    timings = {}
+
+    with tempfile.TemporaryDirectory() as tempDir:
+        electionDir = os.path.join(tempDir, str(scale))
+        paths = generate_election(electionDir, scale, contests, countiesPerLayout)
+        processor = XLSProcessor(electionDir + os.sep, os.path.join(tempDir, 'statewide.csv'), memo=NormalizationMemo())
+
+        def clear_memo():
+            processor.memo = NormalizationMemo()
+
+        for layout in LAYOUTS:
+            countyFile = paths[LAYOUTS.index(layout) * countiesPerLayout]
+            county = processor.county_name_for_file(countyFile)
+            process = processor.process_csv_file if layout == 'csv' else processor.process_excel_file
+
+            timings[f'{layout}@{scale}'] = best_time(lambda: process(countyFile, county), repeat, clear_memo)
+
+        timings[f'election_directory@{scale}'] = best_time(processor.process_election_directory, repeat, clear_memo)
+
+    return timings
+
+
+def best_time(run, repeat, setup=None):
+    """Best time of repeat calls to run, calling setup before each one, untimed"""
+    times = []
+
+    for _ in range(repeat):
+        if setup:
+            setup()
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+
+    return min(times)
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return {}
+
+    with open(path, 'r') as baselineFile:
+        return json.load(baselineFile)['timings']
+
+
+def save_baseline(path, timings, args):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    baseline = {
+        'timings': timings,
+        'settings': {'contests': args.contests, 'countiesPerLayout': args.countiesPerLayout, 'repeat': args.repeat},
+        'environment': {'python': platform.python_version(), 'pandas': pd.__version__, 'machine': platform.machine()},
+    }
+
+    with open(path, 'w') as baselineFile:
+        json.dump(baseline, baselineFile, indent=2, sort_keys=True)
+
+
+def report(timings, baseline, tolerance):
+    """Prints each case against its baseline, and returns the cases that regressed"""
+    regressions = []
+    print(f"{'case':<28} {'baseline':>10} {'now':>10} {'ratio':>7}")
+
+    for case, seconds in timings.items():
+        if case not in baseline:
+            print(f"{case:<28} {'-':>10} {seconds:>9.3f}s {'-':>7}")
+            continue
+
+        ratio = seconds / baseline[case]
+        flag = ' REGRESSION' if ratio > 1 + tolerance else ''
+        print(f"{case:<28} {baseline[case]:>9.3f}s {seconds:>9.3f}s {ratio:>6.2f}x{flag}")
+
+        if flag:
+            regressions.append(case)
+
+    return regressions
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/local/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark for the workbook reader backends on large "Table of Contents" workbooks
+
+Generates a Table of Contents workbook with generate_county_files.py and
+reads it the way the converter does (the contents sheet, then every
+contest sheet) with each backend that can read it, checking they all parse
+the same frames. Reports the best time of --repeat runs and the peak of
+Python allocations while reading.
+
+pandas can no longer write .xls files, so the xlrd backend is only timed on
+workbooks passed with --workbook, e.g. an .xls file from the SOS:
+
+    python benchmarks/bench_excel_readers.py --precincts 2000 --contests 40
+    python benchmarks/bench_excel_readers.py --workbook data/AL/2016-General/2016-General-Jefferson.xls
+"""
+
+import os, sys
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from convert_spreadsheets_to_csv import EXCEL_READERS
+from generate_county_files import generate_toc_file
+
+
+def main():
+    args = parseArguments()
+
+    if args.workbook:
+        bench_workbook(args.workbook, args.repeat)
+        return
+
+    with tempfile.TemporaryDirectory() as tempDir:
+        path = os.path.join(tempDir, '2020-General-Jefferson.xlsx')
+        generate_toc_file(path, args.precincts, args.contests)
+
+        print(f"Table of Contents workbook: {args.precincts} precincts, {args.contests} contest sheets, {os.path.getsize(path) / 1e6:.1f} MB")
+        bench_workbook(path, args.repeat)
+
+
+def parseArguments():
+    parser = argparse.ArgumentParser(description='Benchmark the workbook reader backends')
+    parser.add_argument('--precincts', type=int, default=1000, help='precincts in the generated workbook')
+    parser.add_argument('--contests', type=int, default=30, help='contest sheets in the generated workbook')
+    parser.add_argument('--workbook', type=str, default=None,
+                        help='time this workbook (.xls or .xlsx) instead of a generated one')
+    parser.add_argument('--repeat', type=int, default=3)
+
+    return parser.parse_args()
+
+
+def bench_workbook(path, repeat):
+    extension = os.path.splitext(path)[1].lower()
+    readers = {name: reader for name, reader in sorted(EXCEL_READERS.items()) if extension in reader.extensions}
+    frames = {}
+
+    print(f"{'reader':<10} {'seconds':>10} {'peak MB':>10}")
+
+    for name, reader in readers.items():
+        seconds = min(time_read(reader, path)[0] for _ in range(repeat))
+
+        tracemalloc.start()
+        frames[name] = read_workbook(reader, path)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        print(f"{name:<10} {seconds:>10.3f} {peak / 1e6:>10.1f}")
+
+    # Every backend has to parse the same frames as pandas
+    for name, sheets in frames.items():
+        for expected, actual in zip(frames['pandas'], sheets):
+            pd.testing.assert_frame_equal(expected, actual)
+
+
+def time_read(reader, path):
+    start = time.perf_counter()
+    sheets = read_workbook(reader, path)
+
+    return (time.perf_counter() - start, sheets)
+
+
+def read_workbook(reader, path):
+    # The contents sheet first, then every sheet it lists, as the converter reads them
+    xl = reader(path, path)
+
+    try:
+        toc = xl.parse(0, header=None)
+        sheets = [toc]
+
+        for sheetName in toc.iloc[1:, 0]:
+            sheets.append(xl.parse(str(sheetName), header=None))
+
+        return sheets
+    finally:
+        xl.close()
+
+
+if __name__ == '__main__':
+    main()
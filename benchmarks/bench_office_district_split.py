@@ -0,0 +1,92 @@
+#!/usr/local/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Micro-benchmark for splitting districts out of contest titles
+
+Compares the old approach, which masks the whole frame once per unique
+contest, with XLSProcessor.populateOfficesAndDistricts, which parses each
+unique contest once and maps the results back onto every row. Each run of
+the latter starts with an empty normalization memo, as the first county
+converted would.
+
+    python benchmarks/bench_office_district_split.py --rows 500000 --contests 200
+"""
+
+import os, sys
+import re
+import timeit
+import argparse
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from convert_spreadsheets_to_csv import XLSProcessor, NormalizationMemo
+
+
+def main():
+    args = parseArguments()
+
+    df = make_contests_frame(args.rows, args.contests)
+    processor = XLSProcessor('', None, memo=NormalizationMemo())
+
+    expected = masked_populate(df.copy())
+    actual = processor.populateOfficesAndDistricts(df.copy())
+    pd.testing.assert_frame_equal(expected, actual)
+
+    masked = min(timeit.repeat(lambda: masked_populate(df.copy()), number=1, repeat=args.repeat))
+    mapped = min(timeit.repeat(lambda: processor.populateOfficesAndDistricts(df.copy()), number=1, repeat=args.repeat,
+                               setup=lambda: setattr(processor, 'memo', NormalizationMemo())))
+
+    print(f"{args.rows} rows, {args.contests} unique contests")
+    print(f"per-contest masking: {masked:.3f}s")
+    print(f"unique-value map:    {mapped:.3f}s ({masked / mapped:.1f}x)")
+
+
+def parseArguments():
+    parser = argparse.ArgumentParser(description='Benchmark office/district splitting')
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--contests', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=3)
+
+    return parser.parse_args()
+
+
+def make_contests_frame(rows, contests):
+    titles = []
+
+    for i in range(contests):
+        if i % 3 == 0:
+            titles.append(f'STATE REPRESENTATIVE, DISTRICT {i}')
+        elif i % 3 == 1:
+            titles.append(f'UNITED STATES REPRESENTATIVE, {i}TH CONGRESSIONAL DISTRICT')
+        else:
+            titles.append(f'PROBATE JUDGE PLACE NO{i}')
+
+    rng = np.random.RandomState(0)
+
+    return pd.DataFrame({
+        'Contest Title': np.array(titles, dtype=object)[rng.randint(0, contests, rows)],
+        'candidate': 'CANDIDATE',
+        'votes': rng.randint(0, 1000, rows),
+    })
+
+
+def masked_populate(df):
+    """The previous implementation of populateOfficesAndDistricts"""
+    df['office'] = df['Contest Title']
+    df['district'] = np.nan
+
+    for contest in df["office"].drop_duplicates():
+        m = re.compile(r'[ ,] (DISTRICT )?(\d+)').search(contest)
+
+        if m:
+            df.loc[df['office'] == contest, 'district'] = m.group(2)
+            df.loc[df['office'] == contest, 'office'] = contest[:m.span()[0]]
+
+    return df
+
+
+if __name__ == '__main__':
+    main()
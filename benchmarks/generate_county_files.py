@@ -0,0 +1,210 @@
+#!/usr/local/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Generates synthetic county files in each layout the converter handles
+
+The files use the offices XLSProcessor.office_map knows, with district
+numbers on the district offices, party suffixes on candidates, a local
+office the converter drops, and the pseudo-precincts each layout carries
+(REPORTED TOTALS, CALCULATED TOTALS, TOTALS). Names follow the SOS
+pattern, so the folder can be passed straight to the converter.
+
+    python benchmarks/generate_county_files.py /tmp/election --precincts 500 --contests 12
+"""
+
+import os, sys
+import argparse
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from convert_spreadsheets_to_csv import XLSProcessor
+
+LAYOUTS = ('contest_title', 'blank_header', 'toc', 'csv')
+
+COUNTIES = ['Autauga', 'Baldwin', 'Barbour', 'Bibb', 'Blount', 'Bullock', 'Butler', 'Calhoun', 'Chambers', 'Cherokee',
+            'Chilton', 'Choctaw', 'Clarke', 'Clay', 'Cleburne', 'Coffee', 'Colbert', 'Conecuh', 'Coosa', 'Covington']
+DISTRICT_OFFICES = frozenset(['United States Representative', 'State Senator', 'State Representative'])
+PARTIES = ['REP', 'DEM', 'LIB', 'IND']
+
+
+def main():
+    args = parseArguments()
+
+    paths = generate_election(args.outDirPath, args.precincts, args.contests, args.countiesPerLayout, args.seed)
+
+    for path in paths:
+        print(path)
+
+
+def parseArguments():
+    parser = argparse.ArgumentParser(description='Generate synthetic county files in every converter layout')
+    parser.add_argument('outDirPath', type=str, help='folder to write the county files to')
+    parser.add_argument('--precincts', type=int, default=50, help='precincts per county')
+    parser.add_argument('--contests', type=int, default=10, help='contests per county')
+    parser.add_argument('--counties-per-layout', dest='countiesPerLayout', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+
+    return parser.parse_args()
+
+
+def generate_election(outDirPath, precincts, contests, countiesPerLayout=1, seed=0, year=2020):
+    """Writes countiesPerLayout county files of each layout to outDirPath
+
+    Returns the paths written, in layout order.
+    """
+    os.makedirs(outDirPath, exist_ok=True)
+    rng = np.random.RandomState(seed)
+    paths = []
+
+    for layout in LAYOUTS:
+        for i in range(countiesPerLayout):
+            # Counties get a number once the list runs out, so every name is unique
+            n = len(paths)
+            county = COUNTIES[n % len(COUNTIES)] + (str(n // len(COUNTIES)) if n >= len(COUNTIES) else '')
+            extension = 'csv' if layout == 'csv' else 'xlsx'
+            path = os.path.join(outDirPath, f'{year}-General-{county}.{extension}')
+
+            write_county_file(layout, path, county, make_contests(rng, contests), precinct_names(precincts), rng)
+            paths.append(path)
+
+    return paths
+
+
+def generate_toc_file(path, precincts, contests, seed=0):
+    """Writes a single Table of Contents workbook with one sheet per contest"""
+    rng = np.random.RandomState(seed)
+    write_toc_file(path, make_contests(rng, contests), precinct_names(precincts), rng)
+
+
+def write_county_file(layout, path, county, contests, precincts, rng):
+    writers = {
+        'contest_title': write_contest_title_file,
+        'blank_header': write_blank_header_file,
+        'toc': write_toc_file,
+        'csv': lambda path, contests, precincts, rng: write_sos_csv_file(path, county, contests, precincts, rng),
+    }
+
+    writers[layout](path, contests, precincts, rng)
+
+
+def make_contests(rng, count):
+    """Picks count contests: (office, district or None, [(candidate, party)])"""
+    # One spelling of each office the converter keeps, leaving out the pseudo-contests
+    officesByName = {}
+    for office, name in XLSProcessor('', None).office_map.items():
+        if name not in ('Registered Voters', 'Ballots Cast', 'Straight Party'):
+            officesByName.setdefault(name, office)
+
+    offices = list(officesByName.values())
+    contests = []
+
+    for i in range(count):
+        # Every tenth contest is a local office, which the converter drops
+        office = 'Probate Judge' if i % 10 == 9 else offices[i % len(offices)]
+        district = int(rng.randint(1, 106)) if office in DISTRICT_OFFICES else None
+        candidates = [(f'CANDIDATE {i}-{c}', PARTIES[c % len(PARTIES)]) for c in range(rng.randint(1, 4))]
+        candidates.append(('Write-In', None))
+        contests.append((office, district, candidates))
+
+    return contests
+
+
+def precinct_names(count):
+    return ['PRECINCT %04d' % i for i in range(count)]
+
+
+def write_contest_title_file(path, contests, precincts, rng):
+    # One row per candidate, one column per precinct
+    rows = [['Contest Title', 'Party', 'Candidate'] + precincts]
+
+    for office, district, candidates in contests:
+        title = office.upper() if district is None else f'{office.upper()}, DISTRICT {district}'
+
+        for candidate, party in candidates:
+            rows.append([title, party, candidate] + list(rng.randint(0, 500, len(precincts))))
+
+    pd.DataFrame(rows).to_excel(path, header=False, index=False)
+
+
+def write_blank_header_file(path, contests, precincts, rng):
+    # Offices across the first row, candidates with "(PARTY)" suffixes across the
+    # second, one row per precinct, then the totals rows
+    offices = [None]
+    candidates = ['Candidate']
+
+    for office, district, contestCandidates in contests:
+        title = office if district is None else f'{office} Dist {district}'
+
+        for i, (candidate, party) in enumerate(contestCandidates):
+            offices.append(title if i == 0 else None)
+            candidates.append(candidate if party is None else f'{candidate} ({party})')
+
+    rows = [offices, candidates]
+    votes = rng.randint(0, 300, (len(precincts), len(candidates) - 1))
+
+    for precinct, precinctVotes in zip(precincts, votes):
+        rows.append([f' {precinct} '] + list(precinctVotes))
+
+    rows.append(['REPORTED TOTALS'] + list(votes.sum(axis=0)))
+    rows.append(['CALCULATED TOTALS'] + list(votes.sum(axis=0)))
+
+    pd.DataFrame(rows).to_excel(path, header=False, index=False)
+
+
+def write_toc_file(path, contests, precincts, rng):
+    # A table of contents sheet listing one sheet per contest. Each contest sheet
+    # has votes and percentage columns per candidate, then a TOTALS row.
+    with pd.ExcelWriter(path) as writer:
+        toc = [['Table of Contents', None]]
+        sheets = []
+
+        for i, (office, district, candidates) in enumerate(contests):
+            title = office.upper() if district is None else f'{office.upper()}, {district}TH DISTRICT'
+            title = f'FOR {title} (Vote For 1)'
+            sheetName = str(i + 2)
+            toc.append([sheetName, title])
+            sheets.append((sheetName, title, candidates))
+
+        pd.DataFrame(toc).to_excel(writer, sheet_name='1', header=False, index=False)
+
+        for sheetName, title, candidates in sheets:
+            header = ['Precinct', None]
+            for candidate, party in candidates:
+                header += [candidate, None]
+            header += ['Total', None]
+
+            rows = [[title], header, [None, None] + ['Votes', '%'] * (len(candidates) + 1)]
+            votes = rng.randint(0, 100, (len(precincts), len(candidates)))
+
+            for precinct, precinctVotes in zip(precincts + ['TOTALS'], list(votes) + [votes.sum(axis=0)]):
+                row = [precinct, None]
+                for vote in list(precinctVotes) + [precinctVotes.sum()]:
+                    row += [vote, 0.5]
+                rows.append(row)
+
+            pd.DataFrame(rows).to_excel(writer, sheet_name=sheetName, header=False, index=False)
+
+
+def write_sos_csv_file(path, county, contests, precincts, rng):
+    # The SOS export: one row per precinct and candidate, including the
+    # registered voters pseudo-contest numbered below 100
+    rows = []
+
+    for precinct in precincts:
+        rows.append([county, '11/3/2020', 1, 1, int(rng.randint(500, 5000)), '', 'REGISTERED VOTERS - TOTAL', 'REGISTERED VOTERS', precinct, ''])
+
+        for contestNumber, (office, district, candidates) in enumerate(contests, 100):
+            title = office.upper() if district is None else f'{office.upper()}, DISTRICT {district}'
+
+            for candidateNumber, (candidate, party) in enumerate(candidates):
+                rows.append([county, '11/3/2020', contestNumber, candidateNumber, int(rng.randint(0, 400)), party or '', title, f' {candidate} ', precinct, ''])
+
+    columns = ['County', 'Election Date', 'Contest Number', 'Candidate Number', 'Votes', 'Party', 'Contest Title', 'Candidate', 'Precinct', 'District']
+    pd.DataFrame(rows, columns=columns).to_csv(path, index=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -45,31 +45,584 @@ import os, sys
 import re
 import glob
 import argparse
+import cProfile
+import hashlib
+import io
+import json
+import pickle
+import time
+import tracemalloc
+import zipfile
+from collections import deque, OrderedDict
+from itertools import islice, repeat
+from concurrent.futures import ProcessPoolExecutor
+from pandas.io.parsers import TextParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+import columnar
+from rollups import Rollups
+
+try:
+    import resource
+except ImportError: # Not available on Windows
+    resource = None
+
+try:
+    import openpyxl
+    from openpyxl.cell.cell import ERROR_CODES
+except ImportError: # Only needed by the openpyxl reader
+    openpyxl = None
 
 def main():
     args = parseArguments()
 
+    cache = None
+    if args.cache:
+        cache = CountyCache(args.cacheDir, args.cacheSize * 1024 * 1024, rebuild=args.rebuild)
+
+    profile = None
+    if args.profile:
+        profile = ConversionProfile(traceMemory=args.profileTracemalloc)
+
     # for election_dir in glob.glob('data/AL/*/'):
-    processor = XLSProcessor(args.inDirPath, args.outFilePath)
+    processor = XLSProcessor(args.inDirPath, args.outFilePath, workers=args.workers, sheet_workers=args.sheetWorkers, downcast=args.downcast, stream=args.stream, cache=cache, profile=profile, reader=args.reader, columnarPath=args.columnar, rollupPath=args.rollups)
 
     if processor: # and processor.supported:
-        processor.process_election_directory()
+        if args.profileCProfile:
+            profiler = cProfile.Profile()
+            profiler.runcall(processor.process_election_directory)
+            profiler.dump_stats(args.profileCProfile)
+        else:
+            processor.process_election_directory()
+
+    if profile:
+        profile.print_summary()
+        profile.save(args.profile)
+        print('Profile saved to: ' + args.profile)
+
+    # A statewide file missing counties isn't a successful conversion
+    return 1 if processor.failed_counties else 0
 
 def parseArguments():
     parser = argparse.ArgumentParser(description='Parse Alabama vote files into OpenElections format')
     parser.add_argument('inDirPath', type=str,
-                        help='path to the Alabama directory given election')
+                        help='path to the Alabama directory given election, or to a .zip of its county files')
     parser.add_argument('outFilePath', type=str,
                         help='path to output the CSV file to')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes used to convert county files in parallel (default: 1)')
+    parser.add_argument('--sheet-workers', dest='sheetWorkers', type=int, default=1,
+                        help='number of processes used to parse the sheets of each "Table of Contents" workbook in parallel (default: 1)')
+    parser.add_argument('--downcast', action='store_true',
+                        help='store numeric columns in the smallest dtype that holds them while converting')
+    parser.add_argument('--rollups', type=str, default=None,
+                        help='folder of vote totals by county, district and statewide to bring up to date with this election')
+    parser.add_argument('--reader', choices=['auto'] + sorted(EXCEL_READERS), default='auto',
+                        help='how workbooks are read: openpyxl streams .xlsx rows, xlrd loads .xls sheets on demand, pandas leaves it to pandas.ExcelFile; auto picks by extension (default: auto)')
+    parser.add_argument('--stream', action='store_true',
+                        help='write each county to the output as soon as it is converted, instead of holding the whole state in memory')
+    parser.add_argument('--columnar', type=str, default=None,
+                        help='also write the statewide results to this .parquet, .feather or .npz file, which the verifier and total checker read without parsing CSV')
+    parser.add_argument('--cache', action='store_true',
+                        help='reuse county frames converted by earlier runs, and save the ones converted by this one; only point it at a directory you trust, as entries are unpickled')
+    parser.add_argument('--cache-dir', dest='cacheDir', type=str, default='.conversion_cache',
+                        help='directory of converted county frames used with --cache (default: .conversion_cache)')
+    parser.add_argument('--cache-size', dest='cacheSize', type=int, default=2048,
+                        help='size in MB above which the least recently used cache entries are removed (default: 2048)')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='reconvert every county file and replace its cache entry')
+    parser.add_argument('--profile', type=str, default=None,
+                        help='record the time, rows and memory of every stage of every county to this report (.json or .csv)')
+    parser.add_argument('--profile-tracemalloc', dest='profileTracemalloc', action='store_true',
+                        help='with --profile, also record the peak Python allocations of each stage (slows conversion down)')
+    parser.add_argument('--profile-cprofile', dest='profileCProfile', type=str, default=None,
+                        help='write cProfile stats of the conversion to this file (main process only)')
+
+    args = parser.parse_args()
+
+    if args.rebuild and not args.cache:
+        parser.error('--rebuild replaces cache entries, so it needs --cache')
+    if args.columnar and not columnar.isColumnarPath(args.columnar):
+        parser.error('--columnar must end in one of: ' + ', '.join(columnar.columnarExtensions))
+    if args.columnar and args.stream:
+        parser.error('--columnar needs the whole statewide frame, so it can\'t be used with --stream')
+    if args.rollups and args.stream:
+        parser.error('--rollups needs every county\'s frame, so it can\'t be used with --stream')
+
+    return args
+
+
+def convert_county_file(inDirPath, countyFile, options):
+    """Converts a single county file in a worker process
+
+    Returns the county name and its normalized frame, or None for the frame
+    if the file's layout isn't recognized.
+    """
+    with XLSProcessor(inDirPath, None, **options) as processor:
+        county_name = processor.run_county_file(countyFile)
+
+        return (county_name, processor.statewide_dict.get(county_name), processor.profile_records())
+
+
+def convert_TOC_sheets(inDirPath, filename, county, sheetNames, options):
+    """Converts some of the sheets of a "Table of Contents" workbook in a worker process
+
+    Returns the normalized frame of each sheet, in the order given, and the
+    profile records of converting them.
+    """
+    with XLSProcessor(inDirPath, None, **options) as processor:
+        xl = processor.open_excel_file(filename)
+
+        try:
+            return ([processor.process_TOC_sheet(xl, sheetName, county) for sheetName in sheetNames], processor.profile_records())
+        finally:
+            xl.close()
+
+
+class CountyCache(object):
+    """Normalized county frames saved by earlier runs
+
+    Each entry is a pickled frame named after a hash of the county file's
+    contents and of everything else that goes into converting it, including
+    the converter's own source, so an edited county file or any change to
+    the converter simply misses the cache.
+    Entries are evicted least recently used first once the directory grows
+    past maxBytes.
+    """
+    version = hashlib.sha256(Path(__file__).read_bytes()).hexdigest() # Changes with any edit to this file
+
+    def __init__(self, path, maxBytes, rebuild=False):
+        self.path = path
+        self.maxBytes = maxBytes
+        self.rebuild = rebuild
+
+    def key(self, countyData, stamp):
+        digest = hashlib.sha256()
+
+        with countyData as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+
+        digest.update(stamp.encode('utf-8'))
+
+        return digest.hexdigest()
+
+    def entryPath(self, key):
+        return os.path.join(self.path, key + '.pkl')
+
+    def get(self, key):
+        if self.rebuild:
+            return None
+
+        entryPath = self.entryPath(key)
+
+        try:
+            df = pd.read_pickle(entryPath)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+        os.utime(entryPath) # Mark as recently used
+
+        return df
+
+    def put(self, key, df):
+        os.makedirs(self.path, exist_ok=True)
+        entryPath = self.entryPath(key)
+
+        # Write to a temporary file first so other workers never read a partial entry
+        tempPath = '{}.{}.tmp'.format(entryPath, os.getpid())
+        df.to_pickle(tempPath, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tempPath, entryPath)
+
+    def evict(self):
+        entries = [entry for entry in os.scandir(self.path) if entry.name.endswith('.pkl')] if os.path.isdir(self.path) else []
+        entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+
+        totalBytes = 0
+        for entry in entries:
+            totalBytes += entry.stat().st_size
+
+            if totalBytes > self.maxBytes:
+                os.remove(entry.path)
+
+
+class ConversionProfile(object):
+    """Time, rows and memory of each stage of converting each county
+
+    Every call to run() adds a record with the county, the stage, its wall
+    time, the rows of the frame going in and coming out, the process's peak
+    RSS so far and, with traceMemory, the peak of Python allocations during
+    the stage. Stages that normalize values also record the hits and misses
+    of the normalization memo. Worker processes get an empty copy from fork() and send their
+    records back to be merged.
+    """
+    def __init__(self, traceMemory=False):
+        self.traceMemory = traceMemory
+        self.records = []
+        self.tracedPeaks = [] # Peak allocations of the stages running, outermost first
+
+    def fork(self):
+        return ConversionProfile(traceMemory=self.traceMemory)
+
+    def run(self, county, stage, function, *args, **kwargs):
+        record = {'county': county, 'stage': stage, 'rows_in': rows_of(args[0]) if args else None}
+
+        if self.traceMemory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+
+            # Keep the enclosing stage's peak before resetting it for this one
+            if self.tracedPeaks:
+                self.tracedPeaks[-1] = max(self.tracedPeaks[-1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            self.tracedPeaks.append(0)
+
+        start = time.perf_counter()
+
+        try:
+            result = function(*args, **kwargs)
+            record['rows_out'] = rows_of(result)
+            return result
+        finally:
+            record['seconds'] = time.perf_counter() - start
+
+            if resource:
+                record['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+            if self.traceMemory:
+                peak = max(self.tracedPeaks.pop(), tracemalloc.get_traced_memory()[1])
+                record['traced_peak_kb'] = peak // 1024
+
+                if self.tracedPeaks:
+                    self.tracedPeaks[-1] = max(self.tracedPeaks[-1], peak)
+
+            self.records.append(record)
+
+    def summary(self):
+        """Totals per stage, in the order stages first ran"""
+        stages = {}
+
+        for record in self.records:
+            stage = stages.setdefault(record['stage'], {'stage': record['stage'], 'calls': 0, 'seconds': 0.0, 'rows_out': 0, 'memo_hits': 0, 'memo_misses': 0})
+            stage['calls'] += 1
+            stage['seconds'] += record['seconds']
+            stage['rows_out'] += record.get('rows_out') or 0
+            stage['memo_hits'] += record.get('memo_hits', 0)
+            stage['memo_misses'] += record.get('memo_misses', 0)
+
+        return list(stages.values())
+
+    def print_summary(self):
+        print('{:<12} {:>6} {:>10} {:>12} {:>10}'.format('stage', 'calls', 'seconds', 'rows out', 'memo hits'))
+
+        for stage in self.summary():
+            lookups = stage['memo_hits'] + stage['memo_misses']
+            hitRate = '{:.1%}'.format(stage['memo_hits'] / lookups) if lookups else ''
+            print('{stage:<12} {calls:>6} {seconds:>10.3f} {rows_out:>12} {hitRate:>10}'.format(hitRate=hitRate, **stage))
+
+    def save(self, path):
+        if path.lower().endswith('.csv'):
+            pd.DataFrame(self.records).to_csv(path, index=False)
+            return
+
+        with open(path, 'w') as reportFile:
+            json.dump({'stages': self.summary(), 'records': self.records}, reportFile, indent=2)
+
+
+def rows_of(value):
+    # Rows of a frame or series passed into or returned from a stage
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+
+    return None
+
+
+class NormalizationMemo(object):
+    """Normalized form of every distinct value seen, shared across counties
+
+    map() factorizes a column, normalizes each distinct value once and maps
+    the results back onto every row. Results are remembered by namespace and
+    value, so the offices and candidates that recur in every county (and in
+    every election a process converts) are normalized only once. The
+    namespace names the normalization and anything it depends on, such as
+    the office map. The least recently used entries are dropped once there
+    are more than maxEntries.
+    """
+    def __init__(self, maxEntries=100000):
+        self.maxEntries = maxEntries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, namespace, value, function):
+        key = (namespace, value)
+        result = self.entries.get(key, self)
+
+        if result is self:
+            self.misses += 1
+            result = self.entries[key] = function(value)
+
+            if len(self.entries) > self.maxEntries:
+                self.entries.popitem(last=False)
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+
+        return result
+
+    def map(self, column, namespace, function, outputs=1):
+        """function(value) for every value of column, as a series
+
+        With outputs=2, function returns a pair and map() returns a series of
+        the firsts and one of the seconds.
+        """
+        codes, uniques = pd.factorize(column)
+        results = [self.lookup(namespace, value, function) for value in uniques]
+
+        # Missing values are coded -1. function is called once, with the
+        # first of them, and its result given to every missing row.
+        missing = np.flatnonzero(codes < 0)
+        missingResult = function(column.to_numpy()[missing[0]]) if len(missing) else None
+
+        if outputs == 1:
+            return self.take(column, results, codes, missingResult)
+
+        return tuple(self.take(column, [result[i] for result in results], codes, missingResult[i] if len(missing) else None)
+                     for i in range(outputs))
+
+    def take(self, column, results, codes, missingResult):
+        mapped = np.empty(len(results) + 1, dtype=object)
+        mapped[:-1] = results
+        mapped[-1] = missingResult # Where the -1 codes of missing values point
+        mapped = mapped[codes]
+
+        # Inferred as Series.map would, so e.g. a column of only NaN is float
+        return pd.Series(mapped, index=column.index, name=column.name).infer_objects()
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else None
+
+
+# Shared by every processor in a process, so counties converted by the same
+# worker, and the elections of a batch run, reuse each other's results
+shared_normalization_memo = NormalizationMemo()
+
+
+# Every reader's parse() takes the options of pandas.ExcelFile.parse, and
+# ncols to read only the first columns of a sheet. nrows and ncols let the
+# openpyxl and xlrd readers stop reading early.
+
+class PandasExcelReader(object):
+    """Reads workbooks with pandas.ExcelFile and whichever engine it picks"""
+    extensions = ('.xls', '.xlsx')
+
+    def __init__(self, source, filename):
+        if filename.lower().endswith('.xls'):
+            # xlrd would otherwise load every sheet up front; only load those we parse
+            if isinstance(source, io.BytesIO):
+                source = xlrd.open_workbook(file_contents=source.getvalue(), on_demand=True)
+            else:
+                source = xlrd.open_workbook(source, on_demand=True)
+
+        self.xl = pd.ExcelFile(source)
+
+    def parse(self, sheet, ncols=None, **kwds):
+        df = self.xl.parse(sheet, **kwds)
+
+        return df.iloc[:, :ncols] if ncols is not None else df
 
+    def close(self):
+        self.xl.close()
 
-    return parser.parse_args()
+
+class OpenpyxlReader(object):
+    """Streams the rows of .xlsx sheets with openpyxl's read-only mode
+
+    Cells are read as plain values rather than cell objects, and converted
+    the way pandas converts them, so sheets parse to the same frames as with
+    pandas.ExcelFile.
+    """
+    extensions = ('.xlsx',) if openpyxl else ()
+
+    def __init__(self, source, filename):
+        self.book = openpyxl.load_workbook(source, read_only=True, data_only=True, keep_links=False)
+
+    def parse(self, sheet, nrows=None, ncols=None, **kwds):
+        worksheet = self.book.worksheets[sheet] if isinstance(sheet, int) else self.book[sheet]
+        worksheet.reset_dimensions() # The dimensions some writers record are wrong
+
+        data = []
+        lastRowWithData = -1
+
+        for row in worksheet.iter_rows(max_row=nrows, max_col=ncols, values_only=True):
+            # Empty cells read as '', error cells as NaN and whole numbers as ints
+            row = ['' if value is None
+                   else int(value) if type(value) is float and value.is_integer()
+                   else np.nan if type(value) is str and value in ERROR_CODES
+                   else value for value in row]
+
+            while row and row[-1] == '':
+                row.pop()
+            if row:
+                lastRowWithData = len(data)
+            data.append(row)
+
+        # Drop trailing empty rows, and pad the rest to the same width
+        data = data[:lastRowWithData + 1]
+        if data:
+            width = max(len(row) for row in data)
+            data = [row + [''] * (width - len(row)) for row in data]
+
+        return sheet_frame(data, **kwds)
+
+    def close(self):
+        self.book.close()
+
+
+class XlrdReader(object):
+    """Reads .xls workbooks with xlrd, loading each sheet only while it is parsed"""
+    extensions = ('.xls',)
+
+    def __init__(self, source, filename):
+        if isinstance(source, io.BytesIO):
+            self.book = xlrd.open_workbook(file_contents=source.getvalue(), on_demand=True)
+        else:
+            self.book = xlrd.open_workbook(source, on_demand=True)
+
+    def parse(self, sheet, nrows=None, ncols=None, **kwds):
+        worksheet = self.book.sheet_by_index(sheet) if isinstance(sheet, int) else self.book.sheet_by_name(sheet)
+        rows = range(worksheet.nrows if nrows is None else min(nrows, worksheet.nrows))
+
+        try:
+            data = [self.convert_row(worksheet.row_values(i, 0, ncols), worksheet.row_types(i, 0, ncols)) for i in rows]
+        finally:
+            # The top of a sheet is usually read before the rest of it, so keep
+            # the sheet loaded until it's read in full
+            if nrows is None:
+                self.book.unload_sheet(worksheet.name)
+
+        return sheet_frame(data, **kwds)
+
+    def convert_row(self, values, types):
+        # Converts cells the way pandas does: whole numbers to ints, errors to NaN
+        row = list(values)
+
+        for i, cellType in enumerate(types):
+            if cellType == xlrd.XL_CELL_NUMBER:
+                if row[i] == int(row[i]):
+                    row[i] = int(row[i])
+            elif cellType == xlrd.XL_CELL_ERROR:
+                row[i] = np.nan
+            elif cellType == xlrd.XL_CELL_BOOLEAN:
+                row[i] = bool(row[i])
+            elif cellType == xlrd.XL_CELL_DATE:
+                row[i] = self.convert_date(row[i])
+
+        return row
+
+    def convert_date(self, value):
+        try:
+            value = xlrd.xldate.xldate_as_datetime(value, self.book.datemode)
+        except OverflowError:
+            return value
+
+        # Excel doesn't tell dates from times; dates on the epoch are times
+        if value.timetuple()[0:3] == ((1904, 1, 1) if self.book.datemode else (1899, 12, 31)):
+            return value.time()
+
+        return value
+
+    def close(self):
+        self.book.release_resources()
+
+
+def sheet_frame(data, **kwds):
+    # Infers the column types of a sheet's rows as pandas.ExcelFile.parse does
+    if not data:
+        return pd.DataFrame()
+
+    return TextParser(data, skip_blank_lines=False, **kwds).read()
+
+
+EXCEL_READERS = {'pandas': PandasExcelReader, 'openpyxl': OpenpyxlReader, 'xlrd': XlrdReader}
+
+
+class ContestTitleLayout(object):
+    """A row per contest and candidate, and a column per precinct
+
+    Used in all 2016 xls files, and some of the earlier Excel files.
+    """
+    name = 'Contest Title'
+
+    def recognizes(self, processor, firstCell):
+        return firstCell == 'Contest Title'
+
+    def process(self, processor, xl, filename, county):
+        processor.process_contest_title_excel_file(processor.read_first_sheet(xl, county), county)
+
+
+class TableOfContentsLayout(object):
+    """A first sheet listing the contests, and a sheet per contest"""
+    name = 'Table of Contents'
+
+    def recognizes(self, processor, firstCell):
+        return firstCell == 'Table of Contents'
+
+    def process(self, processor, xl, filename, county):
+        # Only the sheet names and contest titles of the first sheet are needed
+        processor.process_TOC_excel_file(xl, filename, processor.read_first_sheet(xl, county, ncols=2), county)
+
+
+class BlankHeaderLayout(object):
+    """A column per candidate under a row of offices, and a row per precinct
+
+    Used in many 2014 files. The first cell is blank or names an office.
+    """
+    name = 'blank header'
+
+    def recognizes(self, processor, firstCell):
+        return pd.isnull(firstCell) or firstCell in processor.valid_offices
+
+    def process(self, processor, xl, filename, county):
+        processor.process_blank_header_excel_file(processor.read_first_sheet(xl, county), county)
+
+
+# Layouts of county workbooks, tried in order against the first non-empty
+# cell of the first sheet. A new SOS format is supported by adding a layout
+# with the same methods.
+EXCEL_LAYOUTS = [ContestTitleLayout(), TableOfContentsLayout(), BlankHeaderLayout()]
 
 
 class XLSProcessor(object):
-    def __init__(self, inDirPath, outFilePath):
+    countyFileRE = re.compile(r'\d{4}-(General|Primary)-(.*)\.(csv|xlsx|xls)')
+    tocOfficeRE = re.compile("(FOR )?([\w, -]+) \(Vote For 1\)")
+    contestDistrictRE = re.compile(r'[ ,] (DISTRICT )?(\d+)')
+    officeDistrictRE = re.compile('[\W]+[Dd]ist[\W]+')
+    candidatePartyRE = re.compile('\s*\(\s*([\w\.]+)\s*\)\s*')
+    sortColumns = ['county', 'precinct', 'office', 'district', 'party', 'candidate']
+    floatFormat = '%.f' # How votes and other numbers are written to the output CSV
+    layouts = EXCEL_LAYOUTS
+    sniffRows = 10 # Rows of the first sheet read to find its first non-empty cell
+    sniffColumns = 10 # Columns of those rows read first, as rows can be very wide
+
+    def __init__(self, inDirPath, outFilePath, workers=1, sheet_workers=1, downcast=False, stream=False, cache=None, profile=None, reader='auto', columnarPath=None, rollupPath=None, memo=None):
         self.path = inDirPath
         self.outFilePath = outFilePath
+        self.workers = workers
+        self.sheet_workers = sheet_workers
+        self.downcast = downcast
+        self.stream = stream
+        self.cache = cache
+        self.profile = profile
+        self.reader = reader
+        self.columnarPath = columnarPath
+        self.rollupPath = rollupPath
+        self.memo = memo if memo is not None else shared_normalization_memo
+        self.failed_counties = []
+        self.unrecognized_counties = []
+        # County files are read straight out of a .zip without extracting it
+        self.archive = zipfile.ZipFile(inDirPath) if inDirPath.lower().endswith('.zip') else None
         (dirparent, deepest_dirname) = os.path.split(os.path.dirname(inDirPath))
         self.year = deepest_dirname
         self.supported = False
@@ -103,64 +656,320 @@ class XLSProcessor(object):
 
 
     def process_election_directory(self):
+        """Converts the election and writes the statewide CSV
+
+        Returns the statewide frame that was written, or None when streaming.
+        """
+        try:
+            return self.convert_election()
+        finally:
+            self.close()
+
+    def convert_election(self):
         print('Election: ' + self.path)
+        statewide = None
 
-        for countyFile in glob.glob(f'{self.path}/*'):
-            print(countyFile)
-            m = re.match(r'\d{4}-(General|Primary)-(.*)\.(csv|xlsx|xls)', os.path.basename(countyFile))
+        countyFiles = self.list_county_files()
 
-            if m:
-                county_name = m.group(2)
+        if self.stream:
+            self.write_statewide_csv_streaming(countyFiles)
+        else:
+            for county_name, countyDF in self.convert_county_files(countyFiles):
+                self.statewide_dict[county_name] = countyDF
 
-                print('==> County: ' + county_name)
+            self.report_failed_counties()
+            self.report_unrecognized_counties()
 
-                if m.group(3) == 'xlsx' or m.group(3) == 'xls':
-                    self.process_excel_file(countyFile, county_name)
-                elif m.group(3) == 'csv':
-                    self.process_csv_file(countyFile, county_name)
-            else:
-                (county_name, ext) = os.path.basename(countyFile).split(os.extsep, 1)
-                self.process_excel_file(countyFile, county_name)
-            # break # end after one, for debugging
+            # Concat county results into one dataframe, and save to CSV
+            statewide = self.run_stage('statewide', 'concat_sort', self.concat_statewide)
+            self.run_stage('statewide', 'write', statewide.to_csv, self.outFilePath, index=False, float_format=self.floatFormat)
+
+            if self.columnarPath:
+                self.run_stage('statewide', 'write_columnar', columnar.writeColumnar, columnar.formatResults(statewide, self.floatFormat), self.columnarPath)
+                print('Columnar output saved to: ' + self.columnarPath)
+
+            if self.rollupPath:
+                changed = self.run_stage('statewide', 'rollups', Rollups(self.rollupPath).update, self.statewide_dict)
+                print('Rollups saved to: {} ({} county(ies) regrouped)'.format(self.rollupPath, len(changed)))
+
+        print('Output saved to: ' + self.outFilePath)
+
+        if self.cache:
+            self.cache.evict()
+
+        # print(f"Results for {self.statewide_dict.keys()}")
+
+        return statewide
 
-        # Concat county results into one dataframe, and save to CSV
+    def concat_statewide(self):
         statewide = pd.concat(self.statewide_dict).reset_index()
         statewide.drop('level_1', axis=1, inplace=True)
         statewide.rename(columns={'level_0' : 'county'}, inplace=True)
 
-        statewide = statewide.sort_values(['county', 'precinct', 'office', 'district', 'party', 'candidate'], ascending=True)
-        statewide.to_csv(self.outFilePath, index=False, float_format='%.f')
-        print('Output saved to: ' + self.outFilePath)
+        return statewide.sort_values(self.sortColumns, ascending=True)
 
-        # save_presidential_vote_by_county(statewide, year)
-        # save_us_house_vote_by_district(statewide, year)
+    def run_stage(self, county, stage, function, *args, **kwargs):
+        """Calls function(*args, **kwargs), recording it as a stage of county when profiling"""
+        if self.profile is None:
+            return function(*args, **kwargs)
 
-        # print(f"Results for {self.statewide_dict.keys()}")
+        (hits, misses) = (self.memo.hits, self.memo.misses)
+
+        try:
+            return self.profile.run(county, stage, function, *args, **kwargs)
+        finally:
+            # Stages that normalize values also record how often the memo had them
+            if self.memo.hits + self.memo.misses > hits + misses:
+                self.profile.records[-1].update(memo_hits=self.memo.hits - hits, memo_misses=self.memo.misses - misses)
+
+    def profile_records(self):
+        return self.profile.records if self.profile else None
+
+    def merge_profile_records(self, records):
+        if records:
+            self.profile.records.extend(records)
+
+
+    def write_statewide_csv_streaming(self, countyFiles):
+        # County is the leading sort key, so sorting each county on its own and
+        # writing the counties in name order gives the same file as sorting the
+        # whole state at once. Only the counties not yet written stay in memory.
+        filesByCounty = {self.county_name_for_file(countyFile): countyFile for countyFile in countyFiles}
+        countyFiles = [filesByCounty[county_name] for county_name in sorted(filesByCounty)]
+
+        with open(self.outFilePath, 'w', newline='') as outFile:
+            header = True
+
+            for county_name, countyDF in self.convert_county_files(countyFiles):
+                if countyDF.empty:
+                    continue
+
+                countyDF = self.run_stage(county_name, 'concat_sort', countyDF.sort_values, self.sortColumns[1:], ascending=True)
+                countyDF.insert(0, 'county', county_name)
+                self.run_stage(county_name, 'write', countyDF.to_csv, outFile, index=False, header=header, float_format=self.floatFormat)
+                header = False
+
+        self.report_failed_counties()
+        self.report_unrecognized_counties()
+
+    def close(self):
+        if self.archive:
+            self.archive.close()
+            self.archive = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    def list_county_files(self):
+        if self.archive:
+            return [info.filename for info in self.archive.infolist() if not info.is_dir()]
+
+        return glob.glob(f'{self.path}/*')
+
+    def open_county_file(self, countyFile):
+        if self.archive:
+            return self.archive.open(countyFile)
+
+        return open(countyFile, 'rb')
+
+    def county_file_source(self, countyFile):
+        # What the parsers read from: the path, or the archive member in memory
+        if self.archive:
+            with self.archive.open(countyFile) as member:
+                return io.BytesIO(member.read())
+
+        return countyFile
+
+    def convert_county_files(self, countyFiles):
+        """Yields (county, frame) for each county file that converts, in the order given"""
+        if self.workers > 1:
+            yield from self.convert_county_files_in_parallel(countyFiles)
+            return
+
+        for countyFile in countyFiles:
+            try:
+                county_name = self.run_county_file(countyFile)
+            except Exception as e:
+                self.report_county_failure(countyFile, e)
+                continue
+
+            countyDF = self.statewide_dict.pop(county_name, None)
+
+            if countyDF is not None:
+                yield (county_name, countyDF)
+            # break # end after one, for debugging
+
+    def county_name_for_file(self, countyFile):
+        m = self.countyFileRE.match(os.path.basename(countyFile))
+
+        if m:
+            return m.group(2)
+
+        return os.path.basename(countyFile).split(os.extsep, 1)[0]
+
+    def run_county_file(self, countyFile):
+        """Converts a county file, recording the whole county as one stage when profiling"""
+        if self.profile is None:
+            return self.process_county_file(countyFile)
+
+        county_name = self.profile.run(self.county_name_for_file(countyFile), 'county', self.process_county_file, countyFile)
+        countyDF = self.statewide_dict.get(county_name)
+
+        with self.open_county_file(countyFile) as f:
+            inputBytes = f.seek(0, io.SEEK_END)
+
+        self.profile.records[-1].update(input_bytes=inputBytes, rows_out=None if countyDF is None else len(countyDF))
+
+        return county_name
+
+    def process_county_file(self, countyFile):
+        if not self.cache:
+            return self.parse_county_file(countyFile)
+
+        county_name = self.county_name_for_file(countyFile)
+        key = self.cache.key(self.open_county_file(countyFile), self.cache_stamp(county_name))
+        countyDF = self.cache.get(key)
+
+        if countyDF is not None:
+            print(countyFile)
+            print('==> County: {} (cached)'.format(county_name))
+            self.statewide_dict[county_name] = countyDF
+        else:
+            county_name = self.parse_county_file(countyFile)
+
+            if county_name in self.statewide_dict:
+                self.cache.put(key, self.statewide_dict[county_name])
+
+        return county_name
+
+    def cache_stamp(self, county):
+        # Everything besides the file's contents that the converted frame depends on
+        return repr((CountyCache.version, pd.__version__, county, self.year, self.downcast,
+                     sorted(self.office_map.items()), sorted(self.candidate_map.items()), sorted(self.valid_offices)))
+
+    def parse_county_file(self, countyFile):
+        print(countyFile)
+        m = self.countyFileRE.match(os.path.basename(countyFile))
+
+        if m:
+            county_name = m.group(2)
+
+            print('==> County: ' + county_name)
+
+            if m.group(3) == 'xlsx' or m.group(3) == 'xls':
+                self.process_excel_file(countyFile, county_name)
+            elif m.group(3) == 'csv':
+                self.process_csv_file(countyFile, county_name)
+        else:
+            (county_name, ext) = os.path.basename(countyFile).split(os.extsep, 1)
+            self.process_excel_file(countyFile, county_name)
+
+        return county_name
+
+    def convert_county_files_in_parallel(self, countyFiles):
+        # One task per county. Results are collected in the order the files
+        # were given, so the output is exactly that of the serial path. Only
+        # two counties per worker are submitted ahead of the one being
+        # handed off, so finished frames don't pile up while it's written.
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            countyFiles = iter(countyFiles)
+            futures = deque(self.submit_county_files(executor, islice(countyFiles, 2 * self.workers)))
+
+            while futures:
+                countyFile, future = futures.popleft() # Don't keep finished frames alive once they're handed off
+                futures.extend(self.submit_county_files(executor, islice(countyFiles, 1)))
+
+                try:
+                    county_name, countyDF, records = future.result()
+                except Exception as e:
+                    self.report_county_failure(countyFile, e)
+                    continue
+
+                self.merge_profile_records(records)
+
+                if countyDF is not None:
+                    yield (county_name, countyDF)
+                else:
+                    self.unrecognized_counties.append(county_name)
+
+    def submit_county_files(self, executor, countyFiles):
+        return [(countyFile, executor.submit(convert_county_file, self.path, countyFile, self.worker_options())) for countyFile in countyFiles]
+
+    def worker_options(self):
+        # Options a worker process needs to convert a county the same way this processor would
+        return {'sheet_workers': self.sheet_workers, 'downcast': self.downcast, 'cache': self.cache,
+                'profile': self.profile.fork() if self.profile else None, 'reader': self.reader}
+
+    def report_failed_counties(self):
+        if self.failed_counties:
+            print('Failed to convert {} county file(s): {}'.format(len(self.failed_counties), ', '.join(self.failed_counties)))
 
+    def report_unrecognized_counties(self):
+        if self.unrecognized_counties:
+            print('Not yet able to process {} county(ies): {}'.format(len(self.unrecognized_counties), ', '.join(self.unrecognized_counties)))
+
+    def report_county_failure(self, countyFile, error):
+        print('ERROR: Could not convert {}: {}'.format(countyFile, error))
+        self.failed_counties.append(os.path.basename(countyFile))
+
+    def open_excel_file(self, filename):
+        return self.excel_reader_for(filename)(self.county_file_source(filename), filename)
+
+    def excel_reader_for(self, filename):
+        # Files the chosen reader can't read fall back to pandas
+        extension = os.path.splitext(filename)[1].lower()
+
+        if self.reader == 'auto':
+            return next((reader for reader in (XlrdReader, OpenpyxlReader) if extension in reader.extensions), PandasExcelReader)
+
+        reader = EXCEL_READERS[self.reader]
+        return reader if extension in reader.extensions else PandasExcelReader
 
     def process_excel_file(self, filename, county):
-        xl = pd.ExcelFile(filename)
+        xl = self.open_excel_file(filename)
 
-        # Read the first sheet
-        df = xl.parse(0, header=None) # Leave out headers because the two formats use them differently
-        df = self.stripCellsDropEmptyRows(df)
+        try:
+            self.process_excel_sheets(xl, filename, county)
+        finally:
+            xl.close()
 
+    def process_excel_sheets(self, xl, filename, county):
         # Process spreadsheet differently depending on the first cell
-        firstCell = df.iloc[0, 0] # Contents of very first cell
-
-        # print(f"{firstCell}")
-        if firstCell == 'Contest Title':
-            self.process_contest_title_excel_file(df, county)
-        elif firstCell == 'Table of Contents':
-            self.process_TOC_excel_file(xl, df, county)
-        elif pd.isnull(firstCell) or firstCell in self.valid_offices:
-            self.process_blank_header_excel_file(df, county)
-        else:
-            print('Not yet able to process this county: {}'.format(county))
+        firstCell = self.run_stage(county, 'sniff', self.sniff_first_cell, xl)
+        layout = next((layout for layout in self.layouts if layout.recognizes(self, firstCell)), None)
+
+        if layout is None:
+            self.unrecognized_counties.append(county) # Reported along with the others once every county is converted
+            return
+
+        layout.process(self, xl, filename, county)
+
+    def sniff_first_cell(self, xl):
+        # The first cell of the first sheet as the sheet would be cleaned. The
+        # corner of the sheet settles it when its first row isn't empty there;
+        # otherwise whether a row is empty depends on every column, so whole
+        # rows are read, and the whole sheet if its first rows are all empty.
+        df = self.stripCellsDropEmptyRows(xl.parse(0, header=None, nrows=self.sniffRows, ncols=self.sniffColumns))
+
+        if df.empty or df.index[0] != 0:
+            df = self.stripCellsDropEmptyRows(xl.parse(0, header=None, nrows=self.sniffRows))
+
+        if df.empty:
+            df = self.stripCellsDropEmptyRows(xl.parse(0, header=None))
+
+        return df.iloc[0, 0]
+
+    def read_first_sheet(self, xl, county, **kwds):
+        df = self.run_stage(county, 'read', xl.parse, 0, header=None, **kwds) # Leave out headers because the formats use them differently
+        return self.run_stage(county, 'clean', self.stripCellsDropEmptyRows, df)
 
 
     #
     # This format is used in all 2016 xls files, and some of the earlier Excel files
+    # (ContestTitleLayout)
     #
     def process_contest_title_excel_file(self, df, county):
         # return # Temp while writing the alternative branch
@@ -177,17 +986,17 @@ class XLSProcessor(object):
                             }, inplace=True) # Some normalization to do
 
         # Unpivot the spreadsheet
-        melted = pd.melt(df, id_vars=['Contest Title', 'party', 'candidate'], var_name='precinct', value_name='votes')
+        melted = self.run_stage(county, 'melt', pd.melt, df, id_vars=['Contest Title', 'party', 'candidate'], var_name='precinct', value_name='votes')
 
         melted.dropna(how='any', subset=['votes'], inplace=True) # Drop rows with na for votes
 
-        melted = self.populateOfficesAndDistricts(melted)
-        melted = self.normalizeOfficesAndCandidates(melted)
+        melted = self.run_stage(county, 'split', self.populateOfficesAndDistricts, melted)
+        melted = self.run_stage(county, 'normalize', self.normalizeOfficesAndCandidates, melted)
 
         self.statewide_dict[county] = melted[self.completeColumnNames]
 
     #
-    # This format is used in many 2014 files
+    # This format is used in many 2014 files (BlankHeaderLayout)
     #
     def process_blank_header_excel_file(self, df, county):
         # return # Temp while developing
@@ -212,87 +1021,91 @@ class XLSProcessor(object):
 
         # Melt the spreadsheet into an OE-friendly format
         # print(df.iloc[:, 0].head(5))
-        melted = pd.melt(df, id_vars=['office', 'candidate'], var_name='precinct', value_name='votes')
+        melted = self.run_stage(county, 'melt', pd.melt, df, id_vars=['office', 'candidate'], var_name='precinct', value_name='votes')
         # print("melted")
 
         melted.dropna(how='any', subset=['votes'], inplace=True) # Drop rows with na for votes
 
-        # Create the new district column and fill with NaN
-        melted['district'] = np.nan
-        melted['party'] = ''
+        # Split out district names from offices, and party names from candidates
+        melted['office'], melted['district'] = self.run_stage(county, 'split', self.splitUniqueValues, melted['office'], self.splitOfficeAndDistrict, ('office_district', self.map_stamp(self.office_map)))
+        melted['candidate'], melted['party'] = self.run_stage(county, 'split', self.splitUniqueValues, melted['candidate'], self.splitCandidateAndParty, 'candidate_party')
 
-        # Split out district names from offices
-        contests = melted["office"].drop_duplicates()
+        # Normalize name of "Total" pseudo-precinct
+        melted.loc[melted["precinct"] == 'REPORTED TOTALS', 'precinct'] = 'Total'
 
-        for contest in contests:
-            # print(f"--- {contest}")
-            office, district = self.identifyOfficeAndDistrict(contest)
+        # Drop any "CALCULATED TOTALS", which we can recalculate ourselves
+        melted = melted.drop(melted[melted["precinct"] == 'CALCULATED TOTALS'].index)
 
-            if district:
-                melted.loc[melted['office'] == contest, 'district'] = district
-                melted.loc[melted['office'] == contest, 'office'] = office
-                # print(melted.loc[melted['office'] == office])
+        melted = self.run_stage(county, 'normalize', self.normalizeOfficesAndCandidates, melted)
 
-        # Split out party names from candidates
-        candidates = melted["candidate"].drop_duplicates()
+        self.statewide_dict[county] = melted[self.completeColumnNames]
 
-        for origCandidate in candidates:
-            # print(f"--- {origCandidate}")
-            candidate, party = self.identifyCandidateAndParty(origCandidate)
-            # print(f"{candidate})
 
-            if party:
-                melted.loc[melted['candidate'] == origCandidate, 'party'] = party
-                melted.loc[melted['candidate'] == origCandidate, 'candidate'] = candidate
-                # print(melted.loc[melted['candidate'] == candidate])
+    def process_TOC_excel_file(self, xl, filename, firstSheetDF, county):
+        # Only the sheets listed for relevant offices are parsed
+        sheetNames = self.relevant_sheets(firstSheetDF)
 
-        # Normalize name of "Total" pseudo-precinct
-        melted.loc[melted["precinct"] == 'REPORTED TOTALS', 'precinct'] = 'Total'
+        if self.sheet_workers > 1 and len(sheetNames) > 1:
+            sheetDFs = self.process_TOC_sheets_in_parallel(filename, sheetNames, county)
+        else:
+            sheetDFs = [self.process_TOC_sheet(xl, sheetName, county) for sheetName in sheetNames]
 
-        # Drop any "CALCULATED TOTALS", which we can recalculate ourselves
-        melted = melted.drop(melted[melted["precinct"] == 'CALCULATED TOTALS'].index)
+        if sheetDFs:
+            self.statewide_dict[county] = self.run_stage(county, 'concat_sort', pd.concat, sheetDFs)
+        else:
+            self.statewide_dict[county] = pd.DataFrame(columns=self.completeColumnNames)
 
-        melted = self.normalizeOfficesAndCandidates(melted)
+    def process_TOC_sheets_in_parallel(self, filename, sheetNames, county):
+        # Each worker opens the workbook once and converts every n-th sheet
+        workers = min(self.sheet_workers, len(sheetNames))
+        positions = [range(len(sheetNames))[i::workers] for i in range(workers)]
+        groups = [[sheetNames[position] for position in group] for group in positions]
 
-        self.statewide_dict[county] = melted[self.completeColumnNames]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(convert_TOC_sheets, repeat(self.path), repeat(filename), repeat(county), groups, repeat(self.worker_options()))
 
+            # Put the sheets back in workbook order
+            sheetDFs = [None] * len(sheetNames)
+            for group, (groupDFs, records) in zip(positions, results):
+                self.merge_profile_records(records)
 
-    def process_TOC_excel_file(self, xl, firstSheetDF, county):
-        countyDF = pd.DataFrame()
-        for sheetName in self.relevant_sheets(firstSheetDF):
-            print(f"--> parse {county} sheet {sheetName}")
-            df = xl.parse(sheetName, header=None) # Leave out headers to define our own later
-            df = self.stripCellsDropEmptyRows(df)
+                for position, sheetDF in zip(group, groupDFs):
+                    sheetDFs[position] = sheetDF
 
-            # Drop duplicated office
-            office = df.iloc[0, 0]
-            m = re.compile("(FOR )?([\w, -]+) \(Vote For 1\)").search(office)
-            if m:
-                office = m.group(2)
+        return sheetDFs
+
+    def process_TOC_sheet(self, xl, sheetName, county):
+        print(f"--> parse {county} sheet {sheetName}")
+        df = self.run_stage(county, 'read', xl.parse, sheetName, header=None) # Leave out headers to define our own later
+        df = self.run_stage(county, 'clean', self.stripCellsDropEmptyRows, df)
 
-            df.drop([0], inplace=True)
+        # Drop duplicated office
+        office = df.iloc[0, 0]
+        m = self.tocOfficeRE.search(office)
+        if m:
+            office = m.group(2)
 
-            # Ignore superfluous "total" data
-            results = df.iloc[:, :-1:2]
+        df.drop([0], inplace=True)
 
-            # Fix naming of columns and totals
-            results.iat[0, 0] = 'precinct'
-            results.iat[-1, 0] = 'Total'
+        # Ignore superfluous "total" data
+        results = df.iloc[:, :-1:2]
 
-            # Set header
-            results.columns = results.iloc[0, :]
-            results = results[2:] # Drop the first two rows
+        # Fix naming of columns and totals
+        results.iat[0, 0] = 'precinct'
+        results.iat[-1, 0] = 'Total'
 
-            melted = pd.melt(results, id_vars=['precinct'], var_name='candidate', value_name='votes')
-            melted['Contest Title'] = office
-            melted['party'] = ''
-            # import pdb; pdb.set_trace()
-            melted = self.populateOfficesAndDistricts(melted)
-            melted = self.normalizeOfficesAndCandidates(melted)
+        # Set header
+        results.columns = results.iloc[0, :]
+        results = results[2:] # Drop the first two rows
 
-            countyDF = countyDF.append(melted[self.completeColumnNames])
+        melted = self.run_stage(county, 'melt', pd.melt, results, id_vars=['precinct'], var_name='candidate', value_name='votes')
+        melted['Contest Title'] = office
+        melted['party'] = ''
+        # import pdb; pdb.set_trace()
+        melted = self.run_stage(county, 'split', self.populateOfficesAndDistricts, melted)
+        melted = self.run_stage(county, 'normalize', self.normalizeOfficesAndCandidates, melted)
 
-        self.statewide_dict[county] = countyDF
+        return melted[self.completeColumnNames]
 
     def relevant_sheets(self, df):
         relevantSheetNames = []
@@ -308,63 +1121,79 @@ class XLSProcessor(object):
         return relevantSheetNames
 
     def process_csv_file(self, filename, county):
-        df = pd.read_csv(filename)
+        df = self.run_stage(county, 'read', pd.read_csv, self.county_file_source(filename))
 
         # Normalize column names
         colNames = ['county', 'election_date', 'contest_number', 'candidate_number', 'votes', 'party', 'Contest Title', 'candidate', 'precinct', 'district_name']
         df.columns = colNames
 
-        df = self.stripCellsDropEmptyRows(df)
+        df = self.run_stage(county, 'clean', self.stripCellsDropEmptyRows, df)
 
         # Drop "registered voters" and "ballots cast"
         df = df.loc[df["contest_number"] >= 100]
 
-        df = self.populateOfficesAndDistricts(df)
-        df = self.normalizeOfficesAndCandidates(df)
+        df = self.run_stage(county, 'split', self.populateOfficesAndDistricts, df)
+        df = self.run_stage(county, 'normalize', self.normalizeOfficesAndCandidates, df)
 
         self.statewide_dict[county] = df[self.completeColumnNames]
 
 
     def populateOfficesAndDistricts(self, df):
-        df['office'] = df['Contest Title'] # duplicate the contest title into the office column
-        df['district'] = np.nan
+        # Split out district names from contest titles into the office and district columns
+        df['office'], df['district'] = self.splitUniqueValues(df['Contest Title'], self.splitContest, 'contest')
 
-        # List of all contests
-        contests = df["office"].drop_duplicates()
+        return df
 
-        # Split out district names from offices
-        for contest in contests:
-            m = re.compile(r'[ ,] (DISTRICT )?(\d+)').search(contest)
+    def splitContest(self, contest):
+        m = self.contestDistrictRE.search(contest)
 
-            if m:
-                # Set district to found number, trim office
-                df.loc[df['office'] == contest, 'district'] = m.group(2)
-                df.loc[df['office'] == contest, 'office'] = contest[:m.span()[0]] # Strip district number off contest
+        if m:
+            return (contest[:m.span()[0]], m.group(2)) # Strip district number off contest
 
-        return df
+        return (contest, np.nan)
 
-    def normalizeOfficesAndCandidates(self, df):
-        df.office = df.office.str.title()
+    def splitUniqueValues(self, column, split, namespace):
+        """Splits each value of a column in two
 
-        # Normalize the office names
-        normalize_offices = lambda o: self.office_map[o] if o in self.office_map else o
-        df.office = df.office.map(normalize_offices)
+        split() is called once per unique value, and its results are mapped back
+        onto every row, rather than masking the whole column for each value.
+        Results are kept in the memo under namespace for the next county.
+        """
+        return self.memo.map(column, namespace, split, outputs=2)
+
+    def map_stamp(self, mapping):
+        # Part of a memo namespace, so results of an edited map aren't reused
+        return repr(sorted(mapping.items()))
+
+    def normalizeOfficesAndCandidates(self, df):
+        # Each distinct office and candidate is normalized once
+        df.office = self.memo.map(df.office, ('office', self.map_stamp(self.office_map)), self.normalizeOffice)
 
         # Drop non-statewide offices in place
         mask = df[~df.office.isin(self.valid_offices)]
         df.drop(mask.index, inplace=True)
 
-        # Normalize pseudo-candidates
-        normalize_pseudocandidates = lambda c: self.candidate_map[c] if c in self.candidate_map else c
-        df.candidate = df.candidate.map(normalize_pseudocandidates)
+        df.candidate = self.memo.map(df.candidate, ('candidate', self.map_stamp(self.candidate_map)), self.normalizeCandidate)
 
         return df
 
+    def normalizeOffice(self, office):
+        if not isinstance(office, str):
+            return np.nan # As .str.title() gives for anything but text
+
+        office = office.title()
+
+        return self.office_map[office] if office in self.office_map else office
+
+    def normalizeCandidate(self, candidate):
+        # Normalize pseudo-candidates
+        return self.candidate_map[candidate] if candidate in self.candidate_map else candidate
+
     def identifyOfficeAndDistrict(self, contest):
         (office, district) = (contest, None)
 
         try:
-            office_district = re.compile('[\W]+[Dd]ist[\W]+').split(contest)
+            office_district = self.officeDistrictRE.split(contest)
 
             if len(office_district) > 1:
                 office, district = office_district
@@ -378,11 +1207,27 @@ class XLSProcessor(object):
 
         return (office, district)
 
+    def splitOfficeAndDistrict(self, contest):
+        office, district = self.identifyOfficeAndDistrict(contest)
+
+        if district:
+            return (office, district)
+
+        return (contest, np.nan)
+
+    def splitCandidateAndParty(self, origCandidate):
+        candidate, party = self.identifyCandidateAndParty(origCandidate)
+
+        if party:
+            return (candidate, party)
+
+        return (origCandidate, '')
+
     def identifyCandidateAndParty(self, origCandidate):
         (candidate, party) = (origCandidate, None)
 
         if not pd.isnull(origCandidate):
-            m = re.compile('\s*\(\s*([\w\.]+)\s*\)\s*').search(origCandidate)
+            m = self.candidatePartyRE.search(origCandidate)
 
             if m:
                 party = m.group(1)
@@ -392,55 +1237,56 @@ class XLSProcessor(object):
 
     # Clean the data
     def stripCellsDropEmptyRows(self, df):
-        df = df.applymap(lambda x: x.strip() if type(x) is str else x) # Strip all cells
-        df = df.replace('', np.NaN, regex=True) # Replace empty cells with NaN
-        df = df.dropna(how='all') # Drop rows that only consist of NaN data
+        columns = {}
+        isEmptyRow = np.ones(len(df), dtype=bool)
 
-        return df
+        # Strip all string cells and replace empty ones with NaN, one column at a time
+        for i in range(df.shape[1]):
+            values = df.iloc[:, i].to_numpy()
 
-    def save_presidential_vote_by_county(self, statewide, year):
-        """Checks presidential vote by county
+            if values.dtype == object:
+                values = self.stripColumn(values)
 
-        Save to CSV in order to confirm results.
+            columns[i] = values
+            isEmptyRow &= pd.isnull(values)
 
-        Note that this count includes provisional ballots.
-        """
+        cleaned = pd.DataFrame(columns, index=df.index)
+        cleaned.columns = df.columns
+        cleaned = cleaned.infer_objects() # Columns left without strings get a numeric dtype
 
-        presidential_by_county = pd.pivot_table(
-            statewide[statewide.office == 'PRESIDENT AND VICE PRESIDENT OF THE UNITED STATES']
-            , columns='candidate'
-            , index='county'
-            , values='votes'
-            , aggfunc='sum'
-            , fill_value=0
-            , margins = True
-            , margins_name = 'Total'
-            )
+        if isEmptyRow.any():
+            cleaned = cleaned[~isEmptyRow] # Drop rows that only consist of NaN data
 
-        presidential_by_county.to_csv('{}_presidential_by_county.csv'.format(year))
+        if self.downcast:
+            cleaned = self.downcastColumns(cleaned)
 
+        return cleaned
 
-    def save_us_house_vote_by_district(self, statewide, year):
-        """Checks US House vote by district
+    def stripColumn(self, values):
+        kind = pd.api.types.infer_dtype(values, skipna=True)
 
-        Save to CSV in order to confirm results.
+        if kind == 'string':
+            # Only strings: strip each unique value once, then map back to every row
+            codes, uniques = pd.factorize(values)
+            stripped = np.array([u.strip() or np.nan for u in uniques] + [np.nan], dtype=object)
 
-        Note that this count includes provisional ballots.
-        """
+            return stripped[codes] # Code -1 (NaN) picks the trailing NaN
+        elif kind in ('mixed', 'mixed-integer'):
+            # Strings mixed with numbers
+            return np.array([(x.strip() or np.nan) if type(x) is str else x for x in values], dtype=object)
 
-        us_house_districts = pd.pivot_table(
-            statewide[statewide.office == 'UNITED STATES REPRESENTATIVE']
-            , columns='party'
-            , index='district'
-            , values='votes'
-            , aggfunc='sum'
-            , fill_value=0
-            , margins = True
-            , margins_name = 'Total'
-            )
+        return values # No strings to strip
 
-        us_house_districts.to_csv('{}_us_house_districts.csv'.format(year))
+    def downcastColumns(self, df):
+        # Shrink numeric columns to the smallest dtype that holds their values exactly
+        for i in np.flatnonzero([pd.api.types.is_integer_dtype(t) for t in df.dtypes]):
+            df.isetitem(i, pd.to_numeric(df.iloc[:, i], downcast='integer'))
+
+        for i in np.flatnonzero([pd.api.types.is_float_dtype(t) for t in df.dtypes]):
+            df.isetitem(i, pd.to_numeric(df.iloc[:, i], downcast='float'))
+
+        return df
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
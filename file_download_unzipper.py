@@ -10,11 +10,57 @@ __twitter__ nate_somewhere
 March 5th 2017 at NICAR2017
 """
 
+import argparse
 import csv
+import hashlib
+import json
 import os
+import re
 import requests
+import sys
+import threading
+import time
 import zipfile
 import glob
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+
+CHUNK_SIZE = 1024 * 1024
+PROGRESS_EVERY = 10 * 1024 * 1024
+
+MANIFEST_NAME = 'manifest.json'
+
+print_lock = threading.Lock()
+
+class Manifest(object):
+    """
+    Records the url, size, ETag/Last-Modified and sha256 of every downloaded file
+
+    Kept as json next to the downloads and rewritten whenever an entry changes,
+    so an interrupted run still leaves what it needs to resume
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+
+        if os.path.exists(path):
+            with open(path, 'r') as manifest_file:
+                self.entries = json.load(manifest_file)
+
+    def get(self, filename):
+        with self.lock:
+            return dict(self.entries.get(filename, {}))
+
+    def update(self, filename, **fields):
+        with self.lock:
+            self.entries.setdefault(filename, {}).update(fields)
+
+            temp_path = f'{self.path}.tmp'
+            with open(temp_path, 'w') as manifest_file:
+                json.dump(self.entries, manifest_file, indent=2, sort_keys=True)
+            os.replace(temp_path, self.path)
+
 
 def open_files_to_download(csv_filepath):
     """
@@ -27,52 +73,315 @@ def open_files_to_download(csv_filepath):
 
     return data
 
-def download_to_folder(filename, file_url, statename='AL'):
+def make_session(pool_size=4):
+    """
+    Creates a requests session whose connection pool is shared by all download threads
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    return session
+
+def report(message):
+    """
+    Prints a line without interleaving it with other download threads
+    """
+    with print_lock:
+        print(message, flush=True)
+
+def file_sha256(file_path, digest=None):
+    """
+    Hashes a file in chunks, continuing digest if one is given
+    """
+    digest = digest or hashlib.sha256()
+    with open(file_path, 'rb') as data:
+        for chunk in iter(lambda: data.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+
+    return digest
+
+def format_progress(filename, downloaded, total, started):
+    """
+    Formats bytes downloaded so far, out of total if known, and throughput
+    """
+    elapsed = max(time.monotonic() - started, 1e-6)
+    megabytes = downloaded / (1024 * 1024)
+    size = f"{megabytes:.1f} MB"
+    if total:
+        size += f" of {total / (1024 * 1024):.1f} MB ({downloaded * 100 // total}%)"
+
+    return f"{filename}: {size} in {elapsed:.1f}s ({megabytes / elapsed:.2f} MB/s)"
+
+def request_headers(file_path, temp_path, file_url, entry):
+    """
+    Builds the headers that skip an unchanged file or resume a partial one
+
+    Returns the headers and the offset the download resumes from
+    """
+    headers = {'Accept-Encoding': 'identity'}
+
+    if entry.get('url') == file_url and os.path.exists(file_path) and entry.get('sha256'):
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers, 0
+
+    partial = entry.get('partial') or {}
+    validator = partial.get('etag') or partial.get('last_modified')
+
+    if partial.get('url') == file_url and os.path.exists(temp_path) and validator:
+        # If-Range makes the server send the whole file instead if it has changed
+        resume_from = os.path.getsize(temp_path)
+        headers['Range'] = f'bytes={resume_from}-'
+        headers['If-Range'] = validator
+        return headers, resume_from
+
+    return headers, 0
+
+def download_to_folder(filename, file_url, statename='AL', session=None, data_dir='data', manifest=None):
     """
     Downloads files to a specific state data folder
     If data dir or state dir do not exist, it creates it for you
+
+    The response is streamed to a temporary file in the same folder, which is
+    renamed into place only once the whole file has arrived. With a manifest,
+    unchanged files are skipped and interrupted downloads are resumed. The
+    manifest entry of a file only changes once its new version is in place;
+    until then the validators of the partial download are kept under 'partial'.
     """
-    download_destination = os.path.join('data', statename)
-    if not os.path.exists(download_destination):
-        os.makedirs(download_destination)
+    download_destination = os.path.join(data_dir, statename)
+    os.makedirs(download_destination, exist_ok=True)
 
     file_path = os.path.join(download_destination, filename)
-    print(f"Downloading {file_url}...")
-    r = requests.get(file_url)
-    with open(file_path, 'wb') as filename:
-        filename.write(r.content)
+    temp_path = f'{file_path}.part'
+    session = session or requests
+    entry = manifest.get(filename) if manifest else {}
+    headers, resume_from = request_headers(file_path, temp_path, file_url, entry)
+    download_again = lambda: download_to_folder(filename, file_url, statename, session, data_dir, manifest)
+
+    started = time.monotonic()
+    with session.get(file_url, stream=True, headers=headers) as r:
+        if r.status_code == 304:
+            report(f"Unchanged {file_path}")
+            return file_path
 
-def unzip_zip_files(datadir, destination_path=None):
+        if r.status_code == 416 and resume_from:
+            r.close()
+            return finish_partial_download(filename, file_url, file_path, temp_path, r.headers.get('Content-Range', ''), entry, manifest, download_again)
+
+        r.raise_for_status()
+
+        if r.status_code == 206:
+            if not resume_from:
+                raise IOError(f"{file_url} sent part of the file when all of it was asked for")
+
+            if content_range_start(r.headers.get('Content-Range', '')) != resume_from:
+                r.close()
+                return restart_download(filename, file_url, temp_path, manifest, download_again)
+
+            report(f"Resuming {file_url} from {resume_from} bytes...")
+            digest = file_sha256(temp_path)
+            mode = 'ab'
+        else:
+            report(f"Downloading {file_url}...")
+            resume_from = 0
+            digest = hashlib.sha256()
+            mode = 'wb'
+
+        total = int(r.headers.get('Content-Length', 0))
+        total = total and resume_from + total
+        validators = {'etag': r.headers.get('ETag'), 'last_modified': r.headers.get('Last-Modified')}
+        resumable = validators['etag'] or validators['last_modified']
+
+        if manifest:
+            # Recorded before streaming so an interrupted download can be resumed
+            manifest.update(filename, partial=dict(validators, url=file_url, size=total or None))
+
+        try:
+            downloaded = resume_from
+            next_report = downloaded + PROGRESS_EVERY
+            with open(temp_path, mode) as temp_file:
+                for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                    temp_file.write(chunk)
+                    digest.update(chunk)
+                    downloaded += len(chunk)
+
+                    if downloaded >= next_report:
+                        report(format_progress(filename, downloaded, total, started))
+                        next_report += PROGRESS_EVERY
+
+            if total and downloaded != total:
+                raise IOError(f"expected {total} bytes but received {downloaded}")
+
+            os.replace(temp_path, file_path)
+        except:
+            # Keep what arrived if the server can tell us later whether it's still current
+            if not (manifest and resumable) and os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    if manifest:
+        manifest.update(filename, url=file_url, size=downloaded, sha256=digest.hexdigest(), partial=None, **validators)
+
+    report(f"Saved {format_progress(file_path, downloaded - resume_from, total and total - resume_from, started)}")
+
+    return file_path
+
+def finish_partial_download(filename, file_url, file_path, temp_path, content_range, entry, manifest, download_again):
+    """
+    Handles a 416 for a resumed download, when the server has nothing past the partial file
+
+    If the file on the server is as long as the partial file (Content-Range
+    bytes */size), the last run received all of it but stopped before
+    renaming it, so it's renamed into place. Otherwise the partial file
+    can't be part of it, and is deleted before downloading the whole file.
+    """
+    size = os.path.getsize(temp_path)
+
+    if content_range.strip() != f'bytes */{size}':
+        return restart_download(filename, file_url, temp_path, manifest, download_again)
+
+    os.replace(temp_path, file_path)
+
+    if manifest:
+        partial = entry['partial']
+        manifest.update(filename, url=file_url, size=size, sha256=file_sha256(file_path).hexdigest(), partial=None,
+            etag=partial.get('etag'), last_modified=partial.get('last_modified'))
+
+    report(f"Saved {file_path}, already downloaded")
+
+    return file_path
+
+def restart_download(filename, file_url, temp_path, manifest, download_again):
+    """
+    Deletes a partial download the server's response can't continue, and downloads the whole file
+    """
+    report(f"Restarting {file_url}, {temp_path} doesn't match it")
+    os.remove(temp_path)
+    if manifest:
+        manifest.update(filename, partial=None)
+    return download_again()
+
+def content_range_start(content_range):
+    """
+    The offset of the first byte of a 206 response, from its Content-Range (bytes start-end/size), or None
+    """
+    match = re.match(r'bytes (\d+)-\d+/(\d+|\*)$', content_range.strip())
+    return int(match.group(1)) if match else None
+
+def filename_for_url(fileurl):
+    """
+    Names the downloaded file after the last part of its url
+    """
+    filename = fileurl.split('/')[-1] # files the filename in the filepath
+    return filename.replace('.exe', '.zip') # Strangely, the 2004 general is saved as an .exe when it's really a .zip
+
+def download_all(file_urls, statename='AL', workers=4, data_dir='data'):
+    """
+    Downloads every election's zip file with a bounded pool of threads sharing one session
+
+    Returns a dictionary (key -> url, value -> path) of the files that downloaded successfully
+    """
+    downloaded = {}
+    manifest = Manifest(os.path.join(data_dir, statename, MANIFEST_NAME))
+
+    with make_session(workers) as session, ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for electionname in file_urls:
+            fileurl = electionname['zipurl']
+            future = executor.submit(download_to_folder, filename_for_url(fileurl), fileurl, statename, session, data_dir, manifest)
+            futures[future] = fileurl
+
+        for future in as_completed(futures):
+            try:
+                downloaded[futures[future]] = future.result()
+            except Exception as e:
+                report(f"ERROR: Can't download {futures[future]}: {e}")
+
+    return downloaded
+
+def unzip_zip_file(zip_file, destination_path, manifest=None):
+    """
+    Unzips one zip file into a file folder with the same name as the zip file
+    Raises an error for files whose sha256 doesn't match the manifest, or that can't be unzipped
+
+    Returns the folder it was unzipped into
+    """
+    zip_file_name = os.path.basename(zip_file)
+    folder_name = zip_file_name.replace('.zip', '').lower()
+    zip_destination = os.path.join(destination_path, folder_name)
+
+    expected_sha256 = manifest.get(zip_file_name).get('sha256') if manifest else None
+    if expected_sha256 and file_sha256(zip_file).hexdigest() != expected_sha256:
+        raise ValueError("doesn't match the sha256 in the manifest")
+
+    with zipfile.ZipFile(zip_file,"r") as zip_ref:
+        zip_ref.extractall(zip_destination)
+
+    return zip_destination
+
+def find_zip_files(datadir):
+    """
+    Lists the zip files anywhere under datadir
+    """
+    return glob.glob(f'{datadir}/**/*.zip', recursive=True)
+
+def unzip_zip_files(datadir, destination_path=None, manifest=None, workers=1):
     """
     Mass unzips all zip files located in your specied data folder
 
-    unzips them into a file folder with the same name as zip file
+    unzips them into a file folder with the same name as zip file,
+    several at a time if workers is more than 1
+
+    Returns a dictionary (key -> zip file, value -> folder) of the files that unzipped successfully
     """
     if not destination_path:
         destination_path = datadir
 
-    zip_files = glob.glob(f'{datadir}/**/*.zip', recursive=True)
+    zip_files = find_zip_files(datadir)
+    unzipped = {}
 
-    for zip_file in zip_files:
-        zip_file_name = os.path.basename(zip_file)
-        folder_name = zip_file_name.replace('.zip', '').lower()
-        zip_destination = os.path.join(destination_path, folder_name)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(unzip_zip_file, zip_file, destination_path, manifest): zip_file for zip_file in zip_files}
 
-        try:
-            with zipfile.ZipFile(zip_file,"r") as zip_ref:
-                zip_ref.extractall(zip_destination)
-        except:
-            print(f"ERROR: Can't unzip {zip_file}")
+        for future in as_completed(futures):
+            try:
+                unzipped[futures[future]] = future.result()
+            except Exception as e:
+                report(f"ERROR: Can't unzip {futures[future]}: {e}")
+
+    if len(unzipped) < len(zip_files):
+        report(f"Failed to unzip {len(zip_files) - len(unzipped)} of {len(zip_files)} zip file(s)")
+
+    return unzipped
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Download and unzip precinct data files')
+    parser.add_argument('csv_file', nargs='?', default="alabama_general_precinct_files.csv", help='CSV of election names and zip file urls')
+    parser.add_argument('--workers', type=int, default=4, help='Number of files to download at once')
+    parser.add_argument('--data-dir', dest='data_dir', default='data', help='Folder to download into')
+    parser.add_argument('--unzip-workers', dest='unzip_workers', type=int, default=1, help='Number of zip files to unzip at once')
+    parser.add_argument('--no-unzip', dest='unzip', action='store_false', help="Leave the zip files as they are; the converter can read them directly")
+
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+    file_urls = open_files_to_download(args.csv_file)
+    downloaded = download_all(file_urls, workers=args.workers, data_dir=args.data_dir)
+    failed = len(downloaded) < len(file_urls)
 
+    if args.unzip:
+        state_dir = os.path.join(args.data_dir, 'AL')
+        zip_files = find_zip_files(state_dir)
+        unzipped = unzip_zip_files(state_dir, manifest=Manifest(os.path.join(state_dir, MANIFEST_NAME)), workers=args.unzip_workers)
+        failed = failed or len(unzipped) < len(zip_files)
 
+    return 1 if failed else 0
 
 if __name__ == '__main__':
-    csv_file = "alabama_general_precinct_files.csv"
-    file_urls = open_files_to_download(csv_file)
-    for electionname in file_urls:
-        fileurl = electionname['zipurl']
-        filename = fileurl.split('/')[-1] # files the filename in the filepath
-        filename = filename.replace('.exe', '.zip') # Strangely, the 2004 general is saved as an .exe when it's really a .zip
-        download_to_folder(filename, fileurl)
-
-    unzip_zip_files('data/AL')
+    sys.exit(main())
@@ -0,0 +1,292 @@
+"""
+Runs download, conversion, verification and total checks for a list of elections
+
+Each election goes through the stages download -> convert -> verify and
+convert -> checksum. A stage is skipped when its inputs and the code that
+runs it are unchanged since the last run, as recorded in a state file. A
+freshly converted frame is handed straight to verification and the total
+checks instead of being read back from the CSV.
+
+The elections CSV has a source and an output column. The source is a zip
+url, a local zip file or a folder of county files; the output is the
+statewide CSV to write, e.g. 2020/20201103__al__general__precinct.csv
+"""
+
+import argparse
+import ast
+import contextlib
+import csv
+import hashlib
+import io
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+
+import convert_spreadsheets_to_csv
+import file_download_unzipper
+from convert_spreadsheets_to_csv import XLSProcessor, CountyCache
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCE_DIRS = (REPO_DIR, os.path.join(REPO_DIR, 'src')) # Where the modules stage keys depend on live
+
+sys.path.insert(0, SOURCE_DIRS[1])
+
+import columnar
+import verifier
+import total_checksum
+
+STATE_VERSION = 1
+
+
+def main():
+    args = parse_arguments()
+    elections = read_elections(args.elections)
+    state = load_state(args.state)
+
+    sources = fetch_sources(elections, args)
+    options = {'cacheDir': args.cacheDir if args.cache else None, 'cacheSize': args.cacheSize, 'force': args.force}
+
+    failed = False
+
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = []
+        for election in elections:
+            source = sources.get(election['source'])
+
+            if source is None:
+                print(f"ERROR: No source for {election['output']}, skipping it")
+                failed = True
+                continue
+
+            futures.append((election['output'], executor.submit(run_election, source, election['output'], state.get(election['output'], {}), options)))
+
+        # Reports are printed in the order the elections were listed
+        for output, future in futures:
+            try:
+                report, records, converted = future.result()
+            except Exception as e:
+                print(f"ERROR: Could not run the pipeline for {output}: {e}")
+                failed = True
+                continue
+
+            print(report, end='')
+            state[output] = records
+            save_state(args.state, state)
+            failed = failed or not converted
+
+    return 1 if failed else 0
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Download, convert, verify and check the totals of Alabama elections')
+    parser.add_argument('elections', type=str,
+                        help='CSV of elections with source (zip url, zip file or folder) and output (statewide CSV path) columns')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='number of elections run at once (default: 1)')
+    parser.add_argument('--download-workers', dest='downloadWorkers', type=int, default=4,
+                        help='number of zip files downloaded at once (default: 4)')
+    parser.add_argument('--data-dir', dest='dataDir', type=str, default='data',
+                        help='folder zip files are downloaded into (default: data)')
+    parser.add_argument('--state', type=str, default='.pipeline_state.json',
+                        help='file recording the inputs each stage last ran on (default: .pipeline_state.json)')
+    parser.add_argument('--force', action='store_true',
+                        help='run every stage even if its inputs are unchanged')
+    parser.add_argument('--cache', action='store_true',
+                        help='reuse county frames converted by earlier runs, and save the ones converted by this one; only point it at a directory you trust, as entries are unpickled')
+    parser.add_argument('--cache-dir', dest='cacheDir', type=str, default='.conversion_cache',
+                        help='directory of converted county frames used with --cache (default: .conversion_cache)')
+    parser.add_argument('--cache-size', dest='cacheSize', type=int, default=2048,
+                        help='size in MB above which the least recently used cache entries are removed (default: 2048)')
+
+    return parser.parse_args()
+
+
+def read_elections(csv_filepath):
+    with open(csv_filepath, 'r') as csvfile:
+        return list(csv.DictReader(csvfile))
+
+
+def load_state(path):
+    if not os.path.exists(path):
+        return {}
+
+    with open(path, 'r') as state_file:
+        state = json.load(state_file)
+
+    # Records written by another version of the pipeline can't be trusted
+    if state.get('version') != STATE_VERSION:
+        return {}
+
+    return state.get('elections', {})
+
+
+def save_state(path, state):
+    temp_path = f'{path}.tmp'
+
+    with open(temp_path, 'w') as state_file:
+        json.dump({'version': STATE_VERSION, 'elections': state}, state_file, indent=2, sort_keys=True)
+
+    os.replace(temp_path, path)
+
+
+def fetch_sources(elections, args):
+    """Download stage: fetches the zip of every election whose source is a url
+
+    Returns a dictionary (key -> source, value -> local path). The manifest
+    kept by the downloader skips files the server reports as unchanged.
+    """
+    urls = [election['source'] for election in elections if election['source'].startswith(('http://', 'https://'))]
+    sources = {election['source']: election['source'] for election in elections if election['source'] not in urls}
+
+    if urls:
+        downloaded = file_download_unzipper.download_all([{'zipurl': url} for url in urls], workers=args.downloadWorkers, data_dir=args.dataDir)
+        sources.update(downloaded)
+
+    return sources
+
+
+def run_election(source, output, records, options):
+    """Runs the convert, verify and checksum stages of one election in a worker process
+
+    Returns everything the stages printed, the updated stage records and
+    whether every county converted. A conversion missing counties isn't
+    recorded, so the next run converts the election again.
+    """
+    report = io.StringIO()
+    records = dict(records)
+
+    with contextlib.redirect_stdout(report):
+        print(f"#### {output}")
+        results = None
+        converted = True
+
+        # Convert
+        key = stage_key(source_digest(source), convert_spreadsheets_to_csv)
+        if is_stale(records, 'convert', key, options, output):
+            cache = CountyCache(options['cacheDir'], options['cacheSize'] * 1024 * 1024) if options['cacheDir'] else None
+            processor = XLSProcessor(source, output, cache=cache)
+            results = columnar.formatResults(processor.process_election_directory(), XLSProcessor.floatFormat)
+            converted = not processor.failed_counties
+
+            if converted:
+                records['convert'] = {'key': key, 'output': file_digest(output)}
+            else:
+                records.pop('convert', None)
+        else:
+            print(f"--> convert: {source} unchanged, keeping {output}")
+
+        # Verify and checksum both depend only on the converted output
+        outputDigest = file_digest(output)
+        for stage, module, run in (('verify', verifier, verify_output), ('checksum', total_checksum, check_output_totals)):
+            key = stage_key(outputDigest, module)
+
+            if is_stale(records, stage, key, options):
+                stageReport = io.StringIO()
+                with contextlib.redirect_stdout(stageReport):
+                    run(output, results)
+
+                records[stage] = {'key': key, 'report': stageReport.getvalue()}
+                print(stageReport.getvalue(), end='')
+            else:
+                print(f"--> {stage}: {output} unchanged, last report:")
+                print(records[stage]['report'], end='')
+
+    return (report.getvalue(), records, converted)
+
+
+def is_stale(records, stage, key, options, output=None):
+    if options['force'] or records.get(stage, {}).get('key') != key:
+        return True
+
+    # An output edited or removed since it was written has to be rebuilt
+    return output is not None and (not os.path.exists(output) or file_digest(output) != records[stage].get('output'))
+
+
+def stage_key(inputDigest, module):
+    """Combines a stage's input with the source of the code that runs it
+
+    That's the module, the modules of this repository it imports, directly
+    or through one another, and this file, which calls them.
+    """
+    digest = hashlib.sha256(inputDigest.encode('utf-8'))
+
+    for path in sorted(module_sources(module) | {os.path.abspath(__file__)}):
+        digest.update(file_digest(path).encode('utf-8'))
+
+    return digest.hexdigest()
+
+
+def module_sources(module):
+    """The source files of module and of every module of this repository it imports
+
+    Imports are read from the source, so modules imported only inside a
+    function, as verifier.py imports columnar, are found too.
+    """
+    sources = set()
+    pending = [os.path.abspath(module.__file__)]
+
+    while pending:
+        path = pending.pop()
+        if path in sources:
+            continue
+
+        sources.add(path)
+        with open(path, 'rb') as source:
+            tree = ast.parse(source.read(), path)
+
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and not node.level:
+                names = [node.module]
+            else:
+                continue
+
+            for name in names:
+                for directory in SOURCE_DIRS:
+                    imported = os.path.join(directory, name.split('.')[0] + '.py')
+                    if os.path.isfile(imported):
+                        pending.append(imported)
+
+    return sources
+
+
+def source_digest(source):
+    if os.path.isdir(source):
+        digest = hashlib.sha256()
+        for path in sorted(os.listdir(source)):
+            if os.path.isfile(os.path.join(source, path)):
+                digest.update(path.encode('utf-8'))
+                digest.update(file_digest(os.path.join(source, path)).encode('utf-8'))
+
+        return digest.hexdigest()
+
+    return file_digest(source)
+
+
+def file_digest(path):
+    return file_download_unzipper.file_sha256(path).hexdigest()
+
+
+def verify_output(output, results):
+    fileVerifier = verifier.Verifier(output)
+
+    if not fileVerifier.ready or "matrix" in fileVerifier.filename:
+        return
+
+    if results is None:
+        fileVerifier.fastMode = True
+        fileVerifier.verify()
+    else:
+        fileVerifier.verifyRowsFast(list(results.columns), results.itertuples(index=False, name=None))
+
+
+def check_output_totals(output, results):
+    checker = total_checksum.TotalChecker(output, False, lowMemory=True, results=results)
+    total_checksum.checkAllTotals(checker, "primary" not in os.path.basename(output))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
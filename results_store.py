@@ -0,0 +1,203 @@
+"""
+Builds and queries a SQLite database of every election's results
+
+    python results_store.py build
+    python results_store.py query --county Jefferson --office "U.S. House" --year 2012 --year 2016 --year 2017 --year 2020
+
+build loads every YYYY/*.csv into results.sqlite, one row per result with
+the election it belongs to. The date, type and level (precinct or county)
+of each election come from its filename, e.g. 20171212__al__special__general__precinct.csv.
+Each file's sha256 is recorded, so later builds only reload the files that
+changed and drop those that were removed.
+
+query prints the matching results as CSV. Text is compared without regard
+to case, and every filter can be given more than once.
+"""
+
+import argparse
+import csv
+import glob
+import os
+import sqlite3
+import sys
+
+import file_download_unzipper
+
+RESULT_COLUMNS = ['county', 'precinct', 'office', 'district', 'party', 'candidate', 'votes']
+ELECTION_TYPES = frozenset(['general', 'primary', 'special', 'runoff'])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS elections (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    date TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    level TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    rows INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    election_id INTEGER NOT NULL REFERENCES elections (id),
+    county TEXT COLLATE NOCASE,
+    precinct TEXT COLLATE NOCASE,
+    office TEXT COLLATE NOCASE,
+    district TEXT COLLATE NOCASE,
+    party TEXT COLLATE NOCASE,
+    candidate TEXT COLLATE NOCASE,
+    votes INTEGER
+);
+CREATE INDEX IF NOT EXISTS results_by_contest ON results (county, office, district);
+CREATE INDEX IF NOT EXISTS results_by_candidate ON results (candidate);
+CREATE INDEX IF NOT EXISTS results_by_precinct ON results (precinct);
+CREATE INDEX IF NOT EXISTS results_by_election ON results (election_id);
+"""
+
+
+def main():
+    args = parse_arguments()
+    store = ResultsStore(args.database)
+
+    if args.command == 'build':
+        loaded, unchanged, removed = store.build(args.root)
+        print(f"Loaded {len(loaded)} file(s), {len(unchanged)} unchanged, {len(removed)} removed")
+        for path in loaded:
+            print(f"--> {path}")
+        return
+
+    filters = {column: getattr(args, column) for column in ('county', 'precinct', 'office', 'district', 'party', 'candidate', 'year', 'date', 'type', 'level')}
+    writer = csv.writer(sys.stdout)
+    writer.writerow(ResultsStore.query_columns)
+
+    for row in store.query(**filters):
+        writer.writerow(row)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Build and query a SQLite database of the results of every election')
+    parser.add_argument('--database', type=str, default='results.sqlite',
+                        help='SQLite database to build or query (default: results.sqlite)')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build', help='load every YYYY/*.csv that changed since the last build')
+    build.add_argument('--root', type=str, default='.',
+                       help='folder holding the YYYY folders of election CSVs (default: .)')
+
+    query = commands.add_parser('query', help='print the results matching every filter given, as CSV')
+    for column in ('county', 'precinct', 'office', 'district', 'party', 'candidate'):
+        query.add_argument(f'--{column}', action='append')
+    query.add_argument('--year', type=int, action='append')
+    query.add_argument('--date', action='append', help='election date, as YYYY-MM-DD')
+    query.add_argument('--type', action='append', help='election type, e.g. general or "special general"')
+    query.add_argument('--level', action='append', choices=['precinct', 'county'],
+                       help='results reported by precinct or by county')
+
+    return parser.parse_args()
+
+
+def describe_election(path):
+    """
+    Date, year, type and level of the election a CSV holds, from its filename
+    """
+    components = os.path.splitext(os.path.basename(path))[0].split('__')
+    date = components[0]
+
+    if len(date) != 8 or not date.isdigit():
+        raise ValueError(f"{path} is not named after an election date")
+
+    return {
+        'date': f'{date[0:4]}-{date[4:6]}-{date[6:8]}',
+        'year': int(date[0:4]),
+        'type': ' '.join(component for component in components[2:] if component in ELECTION_TYPES),
+        'level': 'precinct' if components[-1] == 'precinct' else 'county',
+    }
+
+
+class ResultsStore(object):
+    query_columns = ['date', 'type', 'level'] + RESULT_COLUMNS
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def build(self, root='.'):
+        """
+        Loads the CSVs under root that are new or changed, and forgets those removed
+
+        Returns the paths loaded, those unchanged and those removed.
+        """
+        paths = sorted(os.path.relpath(path, root) for path in glob.glob(os.path.join(root, '[0-9][0-9][0-9][0-9]', '*.csv')))
+        known = dict(self.connection.execute('SELECT path, sha256 FROM elections'))
+        loaded, unchanged = [], []
+
+        for path in paths:
+            sha256 = file_download_unzipper.file_sha256(os.path.join(root, path)).hexdigest()
+
+            if known.get(path) == sha256:
+                unchanged.append(path)
+                continue
+
+            self.load(os.path.join(root, path), path, sha256)
+            loaded.append(path)
+
+        removed = sorted(set(known) - set(paths))
+        for path in removed:
+            with self.connection:
+                self.forget(path)
+
+        return (loaded, unchanged, removed)
+
+    def load(self, file_path, path, sha256):
+        # Each file is replaced in a single transaction, so an interrupted build
+        # leaves either the old results or the new ones
+        election = describe_election(path)
+
+        with self.connection, open(file_path, 'r', newline='') as csv_file:
+            self.forget(path)
+
+            cursor = self.connection.execute(
+                'INSERT INTO elections (path, date, year, type, level, sha256, rows) VALUES (?, ?, ?, ?, ?, ?, 0)',
+                (path, election['date'], election['year'], election['type'], election['level'], sha256))
+            election_id = cursor.lastrowid
+
+            # Columns a file doesn't have are left NULL, as are empty values.
+            # Votes are stored as integers where they are written as one.
+            rows = ([election_id] + [row.get(column) or None for column in RESULT_COLUMNS] for row in csv.DictReader(csv_file))
+            cursor = self.connection.executemany(
+                f"INSERT INTO results (election_id, {', '.join(RESULT_COLUMNS)}) VALUES (?{', ?' * len(RESULT_COLUMNS)})", rows)
+
+            self.connection.execute('UPDATE elections SET rows = ? WHERE id = ?', (cursor.rowcount, election_id))
+
+    def forget(self, path):
+        self.connection.execute('DELETE FROM results WHERE election_id IN (SELECT id FROM elections WHERE path = ?)', (path,))
+        self.connection.execute('DELETE FROM elections WHERE path = ?', (path,))
+
+    def query(self, **filters):
+        """
+        Results matching every filter, in election and file order
+
+        Each filter is a column of results or elections (year, date, type,
+        level) and a list of values, any of which may match.
+        """
+        conditions = []
+        parameters = []
+
+        for column, values in filters.items():
+            if not values:
+                continue
+
+            table = 'e' if column in ('year', 'date', 'type', 'level') else 'r'
+            conditions.append(f"{table}.{column} IN ({', '.join('?' * len(values))})")
+            parameters.extend(values)
+
+        sql = (f"SELECT e.date, e.type, e.level, {', '.join('r.' + column for column in RESULT_COLUMNS)} "
+               'FROM results r JOIN elections e ON e.id = r.election_id')
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY e.date, e.path, r.rowid'
+
+        return self.connection.execute(sql, parameters)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""
+Vote totals by county, by district and statewide, kept up to date county by county
+
+    python rollups.py 2020/20201103__al__general__precinct.csv rollups/2020
+
+Writes three CSVs to the rollup folder, for every normalized office:
+
+- county_office_candidate.csv: votes by county, office, district, party and candidate
+- district_party.csv: votes by office, district and party, for offices with districts
+- statewide.csv: votes by office, district, party and candidate across the state
+
+The county totals come from one grouped pass over the rows, leaving out the
+'Total' pseudo-precinct the counties report; the other two are summed from
+them. The county totals are kept in the folder along with a digest of each
+county's rows, so the next update only regroups counties whose rows changed.
+convert_spreadsheets_to_csv.py --rollups DIR updates them after converting.
+"""
+
+import argparse
+import hashlib
+import os
+import pickle
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+import columnar
+
+KEY_COLUMNS = ['county', 'office', 'district', 'party', 'candidate']
+FLOAT_FORMAT = '%.f'
+
+
+def main():
+    args = parse_arguments()
+
+    statewide = pd.read_csv(args.statewide, dtype=str, keep_default_na=False)
+    rollups = Rollups(args.rollupDir)
+    changed = rollups.update({county: rows for county, rows in statewide.groupby('county', sort=False)})
+
+    print(f"Regrouped {len(changed)} county(ies): {', '.join(changed) or 'none'}")
+    print('Rollups saved to: ' + args.rollupDir)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Sum votes by county, district and statewide for every office')
+    parser.add_argument('statewide', type=str, help='statewide precinct CSV written by the converter')
+    parser.add_argument('rollupDir', type=str, help='folder to write the rollup CSVs to')
+
+    return parser.parse_args()
+
+
+class Rollups(object):
+    """
+    County, district and statewide totals materialized in a folder
+
+    update() takes every county's converted rows and rewrites the three
+    CSVs, regrouping only the counties whose rows changed since the last
+    update.
+    """
+    version = 1 # Bump whenever a change here alters the totals
+    state_name = '.rollup_state.pkl'
+
+    def __init__(self, path):
+        self.path = path
+        self.digests = {}
+        self.county_totals = pd.DataFrame(columns=KEY_COLUMNS + ['votes'])
+        self.load_state()
+
+    def load_state(self):
+        try:
+            with open(os.path.join(self.path, self.state_name), 'rb') as state_file:
+                state = pickle.load(state_file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return
+
+        if state.get('version') == self.version:
+            self.digests = state['digests']
+            self.county_totals = state['county_totals']
+
+    def save_state(self):
+        state = {'version': self.version, 'digests': self.digests, 'county_totals': self.county_totals}
+        state_path = os.path.join(self.path, self.state_name)
+
+        with open(state_path + '.tmp', 'wb') as state_file:
+            pickle.dump(state, state_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(state_path + '.tmp', state_path)
+
+    def update(self, county_frames):
+        """
+        Brings the rollups up to date with county_frames (county -> rows)
+
+        Counties missing from county_frames are dropped from the totals.
+        Returns the counties that were regrouped.
+        """
+        changed = {}
+        digests = {}
+
+        for county, rows in county_frames.items():
+            rows = self.key_rows(county, rows)
+            digests[county] = self.digest(rows)
+
+            if self.digests.get(county) != digests[county]:
+                changed[county] = rows
+
+        # Keep the totals of unchanged counties, and regroup the rest in one pass
+        kept = self.county_totals[self.county_totals.county.isin(set(digests) - set(changed))]
+        county_totals = [kept]
+        if changed:
+            county_totals.append(self.sum_votes(pd.concat(changed.values()), KEY_COLUMNS))
+
+        self.county_totals = pd.concat(county_totals).sort_values(KEY_COLUMNS, kind='mergesort').reset_index(drop=True)
+        self.digests = digests
+
+        os.makedirs(self.path, exist_ok=True)
+        self.write()
+        self.save_state()
+
+        return list(changed)
+
+    def key_rows(self, county, rows):
+        # The key columns as they're written to the CSV, so that 2 and '2' are
+        # one district, and votes as numbers. 'Total' pseudo-precinct rows
+        # would count every vote twice.
+        if 'precinct' in rows.columns:
+            rows = rows[rows.precinct != 'Total']
+
+        keys = columnar.formatResults(rows[[column for column in KEY_COLUMNS if column != 'county']], FLOAT_FORMAT)
+        keys.insert(0, 'county', county)
+        keys['votes'] = pd.to_numeric(rows.votes, errors='coerce').to_numpy()
+
+        return keys
+
+    def digest(self, rows):
+        return hashlib.sha256(pd.util.hash_pandas_object(rows, index=False).to_numpy().tobytes()).hexdigest()
+
+    def sum_votes(self, rows, columns):
+        return rows.groupby(columns, sort=False).votes.sum().reset_index()
+
+    def write(self):
+        county_totals = self.county_totals
+        district_totals = county_totals[county_totals.district != '']
+
+        outputs = {
+            'county_office_candidate.csv': county_totals,
+            'district_party.csv': self.sum_votes(district_totals, ['office', 'district', 'party']),
+            'statewide.csv': self.sum_votes(county_totals, KEY_COLUMNS[1:]),
+        }
+
+        for name, totals in outputs.items():
+            totals = totals.sort_values(list(totals.columns[:-1]), kind='mergesort')
+            totals.to_csv(os.path.join(self.path, name), index=False, float_format=FLOAT_FORMAT)
+
+
+if __name__ == '__main__':
+    main()
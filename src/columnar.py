@@ -0,0 +1,148 @@
+#!/usr/local/bin/python3
+# -*- coding: utf-8 -*-
+
+# Reads and writes statewide results in columnar files, so they can be loaded
+# again without parsing CSV text. Supported formats, chosen by extension:
+#
+#   .parquet, .feather  via pyarrow
+#   .npz                NumPy arrays, with no further dependencies
+#
+# Text columns are dictionary-encoded (categoricals in pandas). Values are
+# stored exactly as they are written to the CSV, so reading a columnar file
+# gives the same strings as reading the CSV would, and votes are stored as
+# integers whenever every one of them is written as a whole number.
+
+import os
+import numpy
+import pandas
+
+columnarExtensions = ('.parquet', '.feather', '.npz')
+
+
+def isColumnarPath(path):
+	return os.path.splitext(path)[1].lower() in columnarExtensions
+
+
+# Formats every value of results as to_csv writes it with floatFormat, so the
+# frame holds the same text as the CSV would
+def formatResults(results, floatFormat):
+	columns = {}
+
+	for column in results.columns:
+		values = results[column]
+		missing = values.isna()
+
+		if values.dtype.kind == 'f':
+			strings = values.map(lambda value: floatFormat % value, na_action='ignore')
+		else:
+			strings = values.astype(str)
+
+		columns[column] = strings.mask(missing, '')
+
+	return pandas.DataFrame(columns)
+
+
+# Encodes formatted results for storage: text columns as categoricals, and
+# votes as integers when they read back as the same text
+def encodeResults(results):
+	encoded = {}
+
+	for column in results.columns:
+		values = results[column]
+
+		if column == 'votes':
+			votes = pandas.to_numeric(values, errors='coerce')
+
+			if not votes.isna().any() and (votes % 1 == 0).all():
+				votes = votes.astype('int64')
+
+				if (votes.astype(str) == values).all():
+					encoded[column] = votes
+					continue
+
+		encoded[column] = values.astype('category')
+
+	return pandas.DataFrame(encoded)
+
+
+def writeColumnar(results, path):
+	results = encodeResults(results).reset_index(drop=True)
+	extension = os.path.splitext(path)[1].lower()
+
+	if extension == '.parquet':
+		results.to_parquet(path, index=False)
+	elif extension == '.feather':
+		results.to_feather(path)
+	elif extension == '.npz':
+		arrays = {'columns': numpy.array(results.columns, dtype=str)}
+
+		for column in results.columns:
+			values = results[column]
+
+			if values.dtype.name == 'category':
+				arrays['codes:' + column] = values.cat.codes.to_numpy()
+				arrays['categories:' + column] = numpy.array(values.cat.categories, dtype=str)
+			else:
+				arrays['values:' + column] = values.to_numpy()
+
+		with open(path, 'wb') as npzfile:
+			numpy.savez(npzfile, **arrays)
+	else:
+		raise ValueError("Not a columnar file: %s" % path)
+
+
+# Reads a file written by writeColumnar. columns, if given, is a function
+# picking the columns to read, as usecols is for pandas.read_csv.
+def readColumnar(path, columns=None):
+	extension = os.path.splitext(path)[1].lower()
+
+	if extension == '.npz':
+		with numpy.load(path, allow_pickle=False) as arrays:
+			names = [column for column in arrays['columns'] if columns is None or columns(column)]
+			results = {}
+
+			for column in names:
+				if 'values:' + column in arrays:
+					results[column] = arrays['values:' + column]
+				else:
+					categories = pandas.Index(arrays['categories:' + column], dtype=object)
+					results[column] = pandas.Categorical.from_codes(arrays['codes:' + column], categories)
+
+			return pandas.DataFrame(results, columns=names)
+
+	if extension == '.parquet':
+		import pyarrow.parquet
+		names = pyarrow.parquet.read_schema(path).names
+		read = pandas.read_parquet
+	elif extension == '.feather':
+		import pyarrow.feather
+		names = pyarrow.feather.read_table(path, memory_map=True).column_names
+		read = pandas.read_feather
+	else:
+		raise ValueError("Not a columnar file: %s" % path)
+
+	return read(path, columns=[column for column in names if columns is None or columns(column)])
+
+
+# Each column of results as its distinct values, in the text csv.reader would
+# read from the CSV, and the index of every row's value among them
+def resultColumns(results):
+	columns = []
+
+	for column in results.columns:
+		values = results[column]
+		if values.dtype.name != 'category':
+			values = values.astype('category')
+
+		# Each distinct value is turned into text once; missing values are coded
+		# -1, so they index the '' at the end
+		text = numpy.array([str(value) for value in values.cat.categories] + [''], dtype=object)
+		textCodes, uniques = pandas.factorize(text)
+		columns.append((textCodes[values.cat.codes.to_numpy()], uniques))
+
+	return columns
+
+
+# Rows of results as csv.reader would return them from the CSV
+def resultRows(results):
+	return zip(*(uniques[codes] for codes, uniques in resultColumns(results)))
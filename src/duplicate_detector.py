@@ -0,0 +1,150 @@
+#!/usr/local/bin/python3
+# -*- coding: utf-8 -*-
+
+# Finds rows whose keys were seen before, in a fixed amount of memory. Only a
+# 64-bit hash and the line of each key are kept, in an open-addressing table
+# of two arrays. When the table would outgrow the memory budget, its entries
+# are written to disk as a run sorted by hash and the table starts over; the
+# runs are merged once every row has been added, so keys first seen before a
+# spill are still found.
+#
+# Rows with the same hash are only probable duplicates: the caller confirms
+# them against the rows themselves, which tells the rare hash collisions apart.
+#
+# Only the standard library is used, as loading NumPy alone would take several
+# times the memory a typical budget allows.
+
+import heapq
+import os
+import tempfile
+from array import array
+
+
+class DuplicateDetector(object):
+	slotBytes = 16 # A hash and a line, 8 bytes each
+	initialCapacity = 1 << 16
+	blockRows = 1 << 16 # Entries read from each run at a time while merging
+
+	def __init__(self, memoryBudget, tempDir=None):
+		self.maxCapacity = 1024
+
+		while self.maxCapacity * 2 * self.slotBytes <= memoryBudget:
+			self.maxCapacity *= 2
+
+		self.tempDir = tempDir # Where the runs' folder is made, if not the default
+		self.runDir = None
+		self.runs = []
+		self.pairs = [] # (line, first line with the same hash since the last spill)
+		self.clear(min(self.initialCapacity, self.maxCapacity))
+
+	def clear(self, capacity):
+		self.capacity = capacity
+		self.hashes = array('q', bytes(8 * capacity)) # 0 marks an empty slot
+		self.lines = array('q', bytes(8 * capacity))
+		self.size = 0
+
+	def add(self, key, line):
+		keyHash = hash(key) or 1
+		hashes = self.hashes
+		mask = self.capacity - 1
+		slot = keyHash & mask
+
+		while True:
+			storedHash = hashes[slot]
+
+			if storedHash == 0:
+				break
+			elif storedHash == keyHash:
+				self.pairs.append((line, self.lines[slot]))
+				return
+
+			slot = (slot + 1) & mask
+
+		hashes[slot] = keyHash
+		self.lines[slot] = line
+		self.size += 1
+
+		if self.size * 10 >= self.capacity * 7: # Keep probe sequences short
+			if self.capacity < self.maxCapacity:
+				self.grow()
+			else:
+				self.spill()
+
+	def grow(self):
+		hashes, lines, size = self.hashes, self.lines, self.size
+		self.clear(self.capacity * 2)
+		mask = self.capacity - 1
+
+		for keyHash, line in zip(hashes, lines):
+			if keyHash:
+				slot = keyHash & mask
+
+				while self.hashes[slot]:
+					slot = (slot + 1) & mask
+
+				self.hashes[slot] = keyHash
+				self.lines[slot] = line
+
+		self.size = size
+
+	def spill(self):
+		hashes, lines = self.hashes, self.lines
+		run = array('q')
+
+		# The table holds each hash once, so sorting by hash sorts by line too
+		for slot in sorted((slot for slot in range(self.capacity) if hashes[slot]), key=hashes.__getitem__):
+			run.append(hashes[slot])
+			run.append(lines[slot])
+
+		if self.runDir is None:
+			self.runDir = tempfile.TemporaryDirectory(prefix='duplicates-', dir=self.tempDir)
+
+		path = os.path.join(self.runDir.name, 'run{}.bin'.format(len(self.runs)))
+		with open(path, 'wb') as runFile:
+			run.tofile(runFile)
+		self.runs.append(path)
+
+		self.clear(self.capacity)
+
+	def readRun(self, path):
+		with open(path, 'rb') as runFile:
+			while True:
+				block = array('q', runFile.read(self.blockRows * self.slotBytes))
+
+				if not block:
+					return
+
+				yield from zip(block[0::2], block[1::2])
+
+	# Returns (line, original line) for every line whose hash was seen on an
+	# earlier line, sorted by line. The original is the first line with that hash.
+	def duplicates(self):
+		if not self.runs:
+			return sorted(self.pairs)
+
+		self.spill()
+
+		# Each run holds the first line of each hash since the spill before it.
+		# Merged in hash order, the first line of a hash is its original, and
+		# any other is a duplicate of it, as are the lines that were found in
+		# the table while that line was there.
+		originals = {}
+		previousHash = original = None
+
+		for keyHash, line in heapq.merge(*(self.readRun(path) for path in self.runs)):
+			if keyHash == previousHash:
+				originals[line] = original
+			else:
+				previousHash = keyHash
+				original = line
+
+		pairs = [(line, originals.get(firstLine, firstLine)) for line, firstLine in self.pairs]
+		pairs.extend(originals.items())
+
+		return sorted(pairs)
+
+	def close(self):
+		if self.runDir is not None:
+			self.runDir.cleanup()
+			self.runDir = None
+			self.runs = []
@@ -0,0 +1,104 @@
+#!/usr/local/bin/python3
+# -*- coding: utf-8 -*-
+
+# Collects the errors the verifier and total checker find in a file. Errors
+# are printed as they always have been, but written out in batches rather
+# than one print at a time. Errors are counted by rule, and with a cap only
+# the first few of each rule are printed and reported, followed by how many
+# more there were. Every error can also go to a JSON Lines report (or a JSON
+# list, for a .json path) of the file, line, rule, message and fields, ending
+# with one record per file of its error counts by rule:
+#
+#   {"file": ..., "line": 12, "rule": "votes-integer", "message": ..., "fields": {...}}
+#   {"file": ..., "counts": {"votes-integer": 1}}
+
+import sys
+import json
+
+
+class ErrorSink(object):
+	bufferSize = 1000 # Lines of output held before they're written
+
+	# report, if given, is an ErrorReport or a list the records are appended to
+	def __init__(self, path, maxPerRule=None, report=None):
+		self.path = path
+		self.maxPerRule = maxPerRule
+		self.report = report
+		self.counts = {}
+		self.output = []
+
+	def error(self, rule, message, line=None, fields=None, showLine=True, showFields=True):
+		count = self.counts.get(rule, 0) + 1
+		self.counts[rule] = count
+
+		if self.maxPerRule is not None and count > self.maxPerRule:
+			return
+
+		if line is not None and showLine:
+			self.output.append("ERROR: Line {}: {}\n".format(line, message))
+		else:
+			self.output.append("ERROR: {}\n".format(message))
+
+		if fields and showFields:
+			self.output.append("{}\n".format(fields))
+
+		if self.report is not None:
+			self.report.append({'file': self.path, 'line': line, 'rule': rule, 'message': message, 'fields': fields or None})
+
+		if len(self.output) >= self.bufferSize:
+			self.flush()
+
+	def flush(self):
+		if self.output:
+			sys.stdout.write(''.join(self.output))
+			self.output = []
+
+	# Prints how many errors of each rule went over the cap, and reports the
+	# file's counts. Called once the whole file has been checked.
+	def finish(self):
+		if self.maxPerRule is not None:
+			for rule, count in self.counts.items():
+				if count > self.maxPerRule:
+					self.output.append("... {} more '{}' error(s) not shown, {} in all\n".format(count - self.maxPerRule, rule, count))
+
+		self.flush()
+
+		if self.report is not None:
+			self.report.append({'file': self.path, 'counts': self.counts})
+
+		self.counts = {}
+
+
+# Writes the records of every file's sink to path, as JSON Lines or, if the
+# path ends in .json, as one JSON list when closed
+class ErrorReport(object):
+	def __init__(self, path):
+		self.path = path
+		self.records = [] if path.lower().endswith('.json') else None
+		self.file = open(path, 'w')
+
+	def append(self, record):
+		if self.records is not None:
+			self.records.append(record)
+		else:
+			self.file.write(json.dumps(record, default=jsonValue) + '\n')
+
+	def close(self):
+		if self.records is not None:
+			json.dump(self.records, self.file, default=jsonValue, indent=1)
+
+		self.file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exception):
+		self.close()
+
+
+# NumPy numbers as the Python numbers they hold, and anything else as text
+def jsonValue(value):
+	if hasattr(value, 'item'):
+		return value.item()
+
+	return str(value)
@@ -25,87 +25,208 @@
 import csv
 import os
 import argparse
+import contextlib
 import pandas
 
+import columnar
+from error_sink import ErrorSink, ErrorReport
+
 
 def main():
 	args = parseArguments()
 
-	for path in args.paths:
-		checker = TotalChecker(path, args.excludeOverUnder)
-		checker.singleError = args.singleError
-		sortColumns = ['county', 'office', 'district']
+	with (ErrorReport(args.errorReport) if args.errorReport else contextlib.nullcontext()) as report:
+		for path in args.paths:
+			checker = TotalChecker(path, args.excludeOverUnder, args.lowMemory or bool(args.chunkSize), args.chunkSize)
+			checker.singleError = args.singleError
+			checker.errorSink = ErrorSink(path, args.maxErrorsPerRule, report)
+			checkAllTotals(checker, args.isGeneral)
+
+
+def checkAllTotals(checker, isGeneral):
+	sortColumns = ['county', 'office', 'district']
+
+	if not isGeneral:
+		sortColumns += ['party']
 
-		if not args.isGeneral:
-			sortColumns += ['party']
+	# Candidate total
+	checkedCandidateTotals = checker.checkTotals(checker.precinctColName, sortColumns + ['candidate'])
 
-		# Candidate total
-		checkedCandidateTotals = checker.checkTotals(checker.precinctColName, sortColumns + ['candidate'])
+	# Precinct total
+	checkedPrecinctTotals = checker.checkTotals('candidate', sortColumns + [checker.precinctColName])
 
-		# Precinct total
-		checkedPrecinctTotals = checker.checkTotals('candidate', sortColumns + [checker.precinctColName])
+	checker.errorSink.finish()
 
-		if not checkedCandidateTotals and not checkedPrecinctTotals:
-			print("No totals to check")
+	if not checkedCandidateTotals and not checkedPrecinctTotals:
+		print("No totals to check")
 
 
 class TotalChecker(object):
-	def __init__(self, path, excludeOverUnder):
+	keyColumns = ['county', 'precinct', 'office', 'district', 'party', 'candidate']
+
+	# results, if given, is a frame of the file's contents already in memory
+	def __init__(self, path, excludeOverUnder, lowMemory=False, chunkSize=None, results=None):
 		self.path = path
 		self.singleError = False
 		self.excludeOverUnder = excludeOverUnder
+		self.lowMemory = lowMemory
+		self.chunkSize = chunkSize
+		self.precinctColName = 'precinct'
+		self.errorSink = ErrorSink(path)
 
 		print("==> {}".format(os.path.basename(path)))
 
-		self.populateResults()
+		if results is None and columnar.isColumnarPath(path):
+			# Columnar files are already categorical, so they're checked as in low memory mode
+			self.lowMemory = True
+			results = columnar.readColumnar(path, self.readOptions()['usecols'])
+
+		if results is not None:
+			self.chunkSize = None
+			self.results = self.prepareResults(self.narrowResults(results))
+		elif not self.chunkSize: # In chunked mode the file is streamed once per check instead
+			self.populateResults()
 
 	def populateResults(self):
-		self.results = pandas.read_csv(self.path).fillna('')
+		self.results = self.prepareResults(pandas.read_csv(self.path, **self.readOptions()))
 
-		self.precinctColName = 'precinct'
+	def readOptions(self):
+		if not self.lowMemory:
+			return {}
+
+		# Only the key columns and votes are read, the keys as categoricals
+		return {
+			'usecols': lambda column: column in self.keyColumns or column == 'votes',
+			'dtype': {column: 'category' for column in self.keyColumns},
+		}
+
+	# Same columns and dtypes that readOptions would have read, with rows
+	# labelled by position so line numbers come out as they would from the file
+	def narrowResults(self, results):
+		if not self.lowMemory:
+			return results.reset_index(drop=True)
+
+		columns = [column for column in results.columns if column in self.keyColumns or column == 'votes']
+		return results[columns].astype({column: 'category' for column in columns if column != 'votes'}).reset_index(drop=True)
+
+	def prepareResults(self, results):
+		if self.lowMemory:
+			for column in results.columns.intersection(self.keyColumns):
+				categories = results[column].cat.add_categories([''] if '' not in results[column].cat.categories else [])
+				results[column] = categories.fillna('').cat.set_categories(sorted(categories.cat.categories))
+
+			votes = pandas.to_numeric(results.votes, downcast='integer')
+			if votes.dtype.kind == 'i' and votes.dtype.itemsize < 4:
+				votes = votes.astype('int32')
+			results['votes'] = votes
+		else:
+			results = results.fillna('')
+			results[['votes']] = results[['votes']].apply(pandas.to_numeric)
+			results[self.precinctColName] = results[self.precinctColName].astype(str)
+
+		return results
+
+	def countedRows(self, results):
+		counted = pandas.Series(True, index=results.index)
 
-		self.results[['votes']] = self.results[['votes']].apply(pandas.to_numeric)
-		self.results['lineNo']  = self.results.index
-		self.results[self.precinctColName] = self.results[self.precinctColName].astype(str)
-		
 		if self.excludeOverUnder:
-			self.results = self.results[(self.results.candidate != 'Over Votes') & 
-										(self.results.candidate != 'Under Votes')]
+			counted &= (results.candidate != 'Over Votes') & (results.candidate != 'Under Votes')
 
-		self.results_sans_totals = self.results.loc[(self.results.candidate != 'Total') & (self.results[self.precinctColName] != 'Total')]
+		return counted
 
+	def splitTotals(self, results, totalColumn, columns):
+		# Masks rather than filtered copies, so only the columns being checked are copied
+		counted = self.countedRows(results)
+		subtotals = counted & (results.candidate != 'Total') & (results[self.precinctColName] != 'Total')
+
+		reported_totals = results.loc[counted & (results[totalColumn] == 'Total'), columns + ['votes']]
+		calculated_totals = results.loc[subtotals, columns + ['votes']].groupby(columns, observed=True).votes.sum()
+
+		return reported_totals, calculated_totals
+
+	def totalsFor(self, totalColumn, columns):
+		if not self.chunkSize:
+			return self.splitTotals(self.results, totalColumn, columns)
+
+		# Sum each chunk, then add up the partial sums. Row labels carry on across
+		# chunks, so line numbers still refer to the whole file.
+		reported_totals = []
+		partial_totals = []
+
+		for chunk in pandas.read_csv(self.path, chunksize=self.chunkSize, **self.readOptions()):
+			reported, partial = self.splitTotals(self.prepareResults(chunk), totalColumn, columns)
+			reported_totals.append(reported)
+			partial_totals.append(partial)
+
+		reported_totals = pandas.concat(reported_totals)
+		calculated_totals = pandas.concat(partial_totals).groupby(level=list(range(len(columns))), observed=True).sum()
+
+		return reported_totals, calculated_totals
 
 	def checkTotals(self, totalColumn, columns):
 		# contests = self.results.drop_duplicates(columns)[columns].values
-		reported_totals = self.results.loc[self.results[totalColumn] == 'Total']
-		reported_totals = reported_totals.set_index(columns).sort_index()
+		reported_totals, calculated_totals = self.totalsFor(totalColumn, columns)
+		reported_totals = reported_totals.assign(lineNo=reported_totals.index)
 		# print(reported_totals.head(10))
 
 		if len(reported_totals):
-			# Calculate our own totals to compare
-			calculated_totals = self.results_sans_totals.groupby(columns).votes.sum()
+			calculated_totals = calculated_totals.rename('calculated').reset_index()
 			# print(calculated_totals.head(10))
 
-			for index, calculated_total in calculated_totals.iteritems():
-				try:
-					# print(f'Checking {index}')
-					reported_total_line = reported_totals.loc[index]
-					reported_total = reported_total_line.votes
-					# print(f'reported: "{reported_total}" vs "{calculated_total}"')
-
-					if reported_total != calculated_total:
-						lineNo = reported_total_line.lineNo + 2 # 1 for header, 1 for zero-indexing
-						print("ERROR: {} total incorrect, contest {} line {}. {} != {}".format(
-							"precinct" if totalColumn == "candidate" else "candidate",
-							index, lineNo, reported_total, calculated_total))
-						# print(row.to_dict())
-
-						if self.singleError:
-							break
-				except:
-					# If we can't find the total, just skip
-					# print(f'No file total available for {index}')
-					pass
+			# Totals whose key names another total (e.g. the county-wide total of all
+			# candidates) have nothing in results_sans_totals to be compared with
+			pseudoTotals = pandas.Series(False, index=reported_totals.index)
+			for column in set(columns) & set(['candidate', self.precinctColName]):
+				pseudoTotals |= reported_totals[column] == 'Total'
+			reported_totals = reported_totals.loc[~pseudoTotals]
+
+			# Pair every reported total with the calculated one in a single join. Vote
+			# columns are joined as objects so the totals print as they were read.
+			totals = pandas.merge(reported_totals.astype({'votes': object}), calculated_totals.astype({'calculated': object}),
+				on=columns, how='outer', indicator='found')
+
+			# A missing reported total is only an error where the county reports other totals
+			countyColumn = columns[0]
+			reportingCounties = reported_totals[countyColumn].unique()
+			missingReported = (totals.found == 'right_only') & totals[countyColumn].isin(reportingCounties)
+			missingCalculated = totals.found == 'left_only'
+			incorrect = (totals.found == 'both') & (totals.votes != totals.calculated)
+
+			errors = totals.loc[missingReported | missingCalculated | incorrect]
+			# Categorical keys are grouped in order of appearance, so sort contests by value
+			contests = errors.astype({column: object for column in columns}).groupby(columns).ngroup()
+			errors = errors.assign(contest=contests).sort_values(['contest', 'lineNo'], kind='mergesort')
+
+			totalName = "precinct" if totalColumn == "candidate" else "candidate"
+
+			for error in errors.itertuples(index=False):
+				index = tuple(getattr(error, column) for column in columns)
+				fields = dict(zip(columns, index))
+
+				if error.found == 'right_only':
+					lineNo = None
+					rule = 'total-missing'
+					fields['calculated'] = error.calculated
+					message = "{} total missing, contest {}. Calculated {}".format(
+						totalName, index, error.calculated)
+				elif error.found == 'left_only':
+					lineNo = int(error.lineNo) + 2
+					rule = 'total-unmatched'
+					fields['reported'] = error.votes
+					message = "{} total has nothing to add up to it, contest {} line {}. Reported {}".format(
+						totalName, index, lineNo, error.votes)
+				else:
+					lineNo = int(error.lineNo) + 2 # 1 for header, 1 for zero-indexing
+					rule = 'total-incorrect'
+					fields.update(reported=error.votes, calculated=error.calculated)
+					message = "{} total incorrect, contest {} line {}. {} != {}".format(
+						totalName, index, lineNo, error.votes, error.calculated)
+
+				# The line is part of the message, and the contest is printed in it
+				self.errorSink.error('{}-{}'.format(totalName, rule), message, lineNo, fields, showLine=False, showFields=False)
+
+				if self.singleError:
+					break
 
 			return True
 
@@ -116,7 +237,11 @@ def parseArguments():
 	parser.add_argument('--verbose', '-v', dest='verbose', action='store_true')
 	parser.add_argument('--excludeOverUnder', dest='excludeOverUnder', action='store_true')
 	parser.add_argument('--singleError', dest='singleError', action='store_true', help='Display only the first error in each file')
-	parser.add_argument('paths', metavar='path', type=str, nargs='+', help='path to a CSV file')
+	parser.add_argument('--lowMemory', dest='lowMemory', action='store_true', help='Read only the columns needed, as categoricals. Keys are compared as written in the file.')
+	parser.add_argument('--chunkSize', dest='chunkSize', type=int, default=None, help='Add up totals in chunks of this many rows, for files larger than memory. Implies --lowMemory.')
+	parser.add_argument('--maxErrorsPerRule', dest='maxErrorsPerRule', type=int, default=None, help='Show only the first N errors of each rule in each file, then how many more there were')
+	parser.add_argument('--errorReport', dest='errorReport', type=str, default=None, help='Also write every error shown to this JSON Lines file (or JSON, for a .json path), with its file, line, rule and contest')
+	parser.add_argument('paths', metavar='path', type=str, nargs='+', help='path to a CSV file, or a .parquet, .feather or .npz file written by the converter')
 	parser.set_defaults(verbose=False)
 
 	# By default, the script will assume the file is a general, --general doesn't have to be specified (but can be).
@@ -24,22 +24,153 @@
 
 import pdb
 import csv
+import io
 import os
 import re
+import time
 import argparse
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+
+from error_sink import ErrorSink, ErrorReport
+from duplicate_detector import DuplicateDetector
+
+# Extensions of the columnar files the converter writes, as in columnar.py.
+# columnar is only imported to read one, since it loads pandas.
+columnarExtensions = ('.parquet', '.feather', '.npz')
+
+def isColumnarPath(path):
+	return os.path.splitext(path)[1].lower() in columnarExtensions
+
 
 def main():
 	args = parseArguments()
 
-	for path in args.paths:
+	with (ErrorReport(args.errorReport) if args.errorReport else contextlib.nullcontext()) as report:
+		if args.jobs > 1:
+			verifyInParallel(args, report)
+			return
+
+		for path in args.paths:
+			verifyPath(path, args, report)
+
+
+def verifyPath(path, args, report=None):
+	verifier = Verifier(path)
+	configureVerifier(verifier, args, report)
+
+	if verifier.ready and "matrix" not in verifier.filename:
+		verifier.verify()
+
+
+# report is where the file's errors are recorded for --errorReport, if anywhere
+def configureVerifier(verifier, args, report=None):
+	verifier.errorSink = ErrorSink(verifier.path, args.maxErrorsPerRule, report)
+	verifier.showPrimaryPartiesError = not args.mutePrimaryPartiesError
+	verifier.showPartiesError = not args.mutePartiesError
+	verifier.showXForDistrictError = not args.muteXForDistrictError
+	verifier.singleErrorMode = args.singleError
+	verifier.fastMode = args.fast
+	verifier.vectorizedMode = args.vectorized
+	verifier.duplicateMemory = args.duplicateMemory
+
+
+# Verifies files in a pool of processes. Files larger than --chunkSize are
+# split into byte ranges that are verified concurrently and merged back in
+# order. Output is printed file by file, in the order the paths were given.
+def verifyInParallel(args, report=None):
+	chunkBytes = int(args.chunkSize * 1024 * 1024)
+
+	with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+		tasks = []
+
+		for path in args.paths:
+			if os.path.isfile(path) and os.path.getsize(path) > chunkBytes and not isColumnarPath(path) and not (args.vectorized or args.duplicateMemory):
+				with open(path, 'r') as csvfile:
+					fieldnames = next(csv.reader(csvfile), None)
+
+				chunks = findChunkBoundaries(path, chunkBytes)
+				futures = [executor.submit(verifyChunk, path, args, fieldnames, chunk) for chunk in chunks]
+				tasks.append((path, fieldnames, chunks, futures))
+			else:
+				tasks.append((path, None, None, executor.submit(verifyPathCapturingOutput, path, args)))
+
+		for path, fieldnames, chunks, futures in tasks:
+			if chunks is None:
+				output, records = futures.result()
+				print(output, end='')
+
+				if report is not None:
+					for record in records:
+						report.append(record)
+				continue
+
+			verifier = Verifier(path)
+			configureVerifier(verifier, args, report)
+
+			if verifier.ready and "matrix" not in verifier.filename:
+				verifier.mergeChunks(fieldnames, chunks, futures, executor)
+
+
+# Returns the output, and the records for --errorReport, which the parent
+# process writes to the report
+def verifyPathCapturingOutput(path, args):
+	output = io.StringIO()
+	records = []
+
+	with contextlib.redirect_stdout(output):
+		try:
+			verifyPath(path, args, records if args.errorReport else None)
+		except Exception as e:
+			print("ERROR: Could not verify {}: {}".format(path, e))
+
+	return (output.getvalue(), records)
+
+
+def verifyChunk(path, args, fieldnames, chunk):
+	with contextlib.redirect_stdout(io.StringIO()):
 		verifier = Verifier(path)
-		verifier.showPrimaryPartiesError = not args.mutePrimaryPartiesError
-		verifier.showPartiesError = not args.mutePartiesError
-		verifier.showXForDistrictError = not args.muteXForDistrictError
-		verifier.singleErrorMode = args.singleError
 
-		if verifier.ready and "matrix" not in verifier.filename:
-			verifier.verify()
+	configureVerifier(verifier, args)
+
+	return verifier.verifyChunk(fieldnames, chunk)
+
+
+def fetchChunkRows(path, fieldnames, chunk, rowIndexes):
+	with contextlib.redirect_stdout(io.StringIO()):
+		verifier = Verifier(path)
+
+	return verifier.fetchChunkRows(fieldnames, chunk, rowIndexes)
+
+
+# Splits a file into (start, end) byte ranges of about chunkBytes each. The
+# file is read with csv.reader, so ranges only end between two records, even
+# when a quoted field holds a line break or an unquoted one a stray quote.
+def findChunkBoundaries(path, chunkBytes):
+	size = os.path.getsize(path)
+	boundaries = [0]
+	position = 0
+
+	# Latin-1 reads a character per byte, and quotes and line breaks are the
+	# same bytes in any encoding the file could be in
+	with open(path, 'r', encoding='latin-1', newline='') as csvfile:
+		def lines():
+			nonlocal position
+
+			for line in csvfile:
+				position += len(line)
+				yield line
+
+		try:
+			for row in csv.reader(lines()):
+				if position - boundaries[-1] >= chunkBytes and position < size:
+					boundaries.append(position)
+		except csv.Error:
+			boundaries = [0] # Verified in one piece, failing just as it would without --jobs
+
+	boundaries.append(size)
+
+	return list(zip(boundaries[:-1], boundaries[1:]))
 
 
 def parseArguments():
@@ -48,9 +179,16 @@ def parseArguments():
 	parser.add_argument('--mutePartiesError', dest='mutePartiesError', action='store_true')
 	parser.add_argument('--muteXForDistrictError', dest='muteXForDistrictError', action='store_true')
 	parser.add_argument('--singleError', dest='singleError', action='store_true', help='Display only the first error in each file')
+	parser.add_argument('--fast', dest='fast', action='store_true', help='Verify rows as plain tuples with every check set up once per file, and report throughput')
+	parser.add_argument('--vectorized', dest='vectorized', action='store_true', help='Load each whole file and check every rule over entire columns at once, and report throughput')
+	parser.add_argument('--jobs', dest='jobs', type=int, default=1, help='Number of processes used to verify files, and chunks of large files, in parallel')
+	parser.add_argument('--chunkSize', dest='chunkSize', type=float, default=4, help='With --jobs, split files larger than this many MB into chunks verified in parallel')
+	parser.add_argument('--duplicateMemory', dest='duplicateMemory', type=float, default=None, help='Find duplicated rows of CSV files in about this many MB, spilling to disk beyond it, instead of keeping every row\'s key in memory')
+	parser.add_argument('--maxErrorsPerRule', dest='maxErrorsPerRule', type=int, default=None, help='Show only the first N errors of each rule in each file, then how many more there were')
+	parser.add_argument('--errorReport', dest='errorReport', type=str, default=None, help='Also write every error shown to this JSON Lines file (or JSON, for a .json path), with its file, line, rule and fields')
 	parser.set_defaults(mutePrimaryPartiesError=False, mutePartiesError=False, muteXForDistrictError=False)
 	parser.add_argument('paths', metavar='path', type=str, nargs='+',
-					   help='path to a CSV file')
+					   help='path to a CSV file, or a .parquet, .feather or .npz file written by the converter')
 
 	return parser.parse_args()
 
@@ -63,6 +201,27 @@ class Verifier(object):
 	officesWithDistricts = frozenset(['U.S. House', 'State Senate', 'State House'])
 	pseudocandidates = frozenset(['Write-ins', 'Under Votes', 'Over Votes', 'Total', 'Total Votes Cast',  'Registered Voters'])
 	normalizedPseudocandidates = frozenset(['writeins', 'undervotes', 'overvotes', 'total', 'totalvotescast', 'registeredvoters'])
+	pseudocandidatePrefixes = tuple(npc[0:4] for npc in normalizedPseudocandidates) # Only check the first 4 characters
+	nonLettersRE = re.compile('[^A-Za-z]+', re.UNICODE)
+
+	# The rule each error message belongs to, by how the message starts
+	errorRules = (
+		('Invalid columns', 'invalid-columns'),
+		('Missing columns', 'missing-columns'),
+		('Row is missing', 'column-count'),
+		('Row has', 'column-count'),
+		("County doesn't match", 'county-filename'),
+		('Use title case', 'county-case'),
+		('Invalid office', 'invalid-office'),
+		('Office ', 'district-missing'),
+		('District must be', 'district-integer'),
+		('Misspelled pseudocandidate', 'pseudocandidate'),
+		('Party missing', 'party-missing'),
+		('Primary results must include a party', 'party-missing'),
+		('Vote count must be an integer', 'votes-integer'),
+		('Vote count must be greater', 'votes-negative'),
+		('Line is duplicated', 'duplicate'),
+	)
 
 	# Return the appropriate subclass based on the path
 	def __new__(cls, path):
@@ -92,8 +251,15 @@ class Verifier(object):
 		self.reader = None
 		self.ready = False
 		self.showPrimaryPartiesError = True
+		self.showPartiesError = True
 		self.showXForDistrictError = True
 		self.singleErrorMode = False
+		self.fastMode = False
+		self.vectorizedMode = False
+		self.errorLog = None
+		self.errorSink = ErrorSink(path)
+		self.duplicateMemory = None
+		self.duplicateDetector = None
 
 		self.countyRE = re.compile("\d{8}__[a-z]{2}_")
 
@@ -108,14 +274,24 @@ class Verifier(object):
 			print("ERROR: {}".format(e))
 
 	def verify(self):
-		self.parseFileAtPath(self.path)
+		try:
+			if isColumnarPath(self.path):
+				self.parseColumnarFileAtPath(self.path)
+			elif self.vectorizedMode:
+				self.parseFileAtPathVectorized(self.path)
+			elif self.fastMode:
+				self.parseFileAtPathFast(self.path)
+			else:
+				self.parseFileAtPath(self.path)
+		finally:
+			self.errorSink.flush() # Errors found before a failure are still shown
 
 	def pathSanityCheck(self, path):
 		if not os.path.exists(path) or not os.path.isfile(path):
 			raise FileNotFoundError("Can't find file at path %s" % path)
 
-		if not os.path.splitext(path)[1] == ".csv":
-			raise ValueError("Filename does not end in .csv: %s" % path)
+		if not os.path.splitext(path)[1] == ".csv" and not isColumnarPath(path):
+			raise ValueError("Filename does not end in .csv or a columnar extension: %s" % path)
 
 		print("==> {}".format(path))
 
@@ -134,10 +310,11 @@ class Verifier(object):
 		return (None, None)
 
 	def parseFileAtPath(self, path):
-		with open(path, 'rU') as csvfile:
+		with open(path, 'r') as csvfile:
 			self.reader = csv.DictReader(csvfile)
 			self.currentRowIndex = 0
 			self.headerColumnCount = 0
+			self.startDuplicateDetector()
 			
 			try:
 				if self.verifyColumns(self.reader.fieldnames):
@@ -155,6 +332,546 @@ class Verifier(object):
 			except StopIteration as si:
 				pass # Stop verifying when exception is thrown
 
+		if self.duplicateDetector is not None:
+			self.printErrorsWithDuplicates(self.reader.fieldnames)
+
+		self.errorSink.finish()
+
+	def parseFileAtPathFast(self, path):
+		with open(path, 'r') as csvfile:
+			reader = csv.reader(csvfile)
+			fieldnames = next(reader, None)
+
+			self.startDuplicateDetector()
+			self.verifyRowsFast(fieldnames, reader)
+
+	# With --duplicateMemory, rows are only added to a DuplicateDetector as the
+	# file is verified, and their other errors logged. Once every row has been
+	# seen, printErrorsWithDuplicates prints them along with the duplicates.
+	def startDuplicateDetector(self):
+		if self.duplicateMemory:
+			self.duplicateDetector = DuplicateDetector(int(self.duplicateMemory * 1024 * 1024))
+			self.errorLog = []
+
+	def printErrorsWithDuplicates(self, fieldnames):
+		errors = self.errorLog
+		self.errorLog = None
+
+		try:
+			pairs = self.duplicateDetector.duplicates()
+		finally:
+			self.duplicateDetector.close()
+			self.duplicateDetector = None
+
+		if pairs:
+			# Rows with the same hash as an earlier one are read back, and only
+			# those with the same key are duplicates of it
+			groups = {}
+			for line, originalLine in pairs:
+				groups.setdefault(originalLine, [originalLine]).append(line)
+
+			rows = self.fetchRows(fieldnames, set(line for group in groups.values() for line in group))
+
+			for group in groups.values():
+				firstLines = {}
+
+				for line in sorted(group):
+					row = rows[line]
+					rowTuple = tuple(row.get(column) for column in ('county', 'precinct', 'office', 'district', 'party', 'candidate'))
+
+					if rowTuple in firstLines:
+						errors.append((line, None, row, firstLines[rowTuple]))
+					else:
+						firstLines[rowTuple] = line
+
+			errors.sort(key=lambda error: (error[0], error[1] is None)) # The duplicate check comes last in each row
+
+		try:
+			for rowIndex, text, row, originalLine in errors:
+				self.currentRowIndex = rowIndex
+
+				if text is None:
+					text = "Line is duplicated (original line {})".format(originalLine)
+
+				self.printError(text, row)
+		except StopIteration as si:
+			pass # Stop verifying when exception is thrown
+
+	# The rows of the file at the given line numbers, as DictReader reads them
+	def fetchRows(self, fieldnames, rowIndexes):
+		rows = {}
+		rowCount = 0
+
+		with open(self.path, 'r') as csvfile:
+			reader = csv.reader(csvfile)
+			next(reader, None)
+
+			for row in reader:
+				if row:
+					rowCount += 1
+
+					if rowCount + 1 in rowIndexes:
+						rows[rowCount + 1] = self.rowDict(fieldnames, row)
+
+		return rows
+
+	# Columnar files hold the same text as the CSV, so they go through the same
+	# checks as --fast without any text to parse
+	def parseColumnarFileAtPath(self, path):
+		import columnar
+
+		results = columnar.readColumnar(path)
+
+		if self.vectorizedMode:
+			self.verifyColumnsVectorized(list(results.columns), columnar.resultColumns(results), time.perf_counter())
+		else:
+			self.verifyRowsFast(list(results.columns), columnar.resultRows(results))
+
+	# Reads the whole file into encoded columns, then checks it column by column.
+	# Rows with the wrong number of columns, or a header with duplicated columns,
+	# need the checks of the row engine, so those files are verified by it instead.
+	#
+	# NumPy, pandas and pyarrow are only imported by the vectorized engine, so
+	# the row engines don't pay for loading them.
+	def parseFileAtPathVectorized(self, path):
+		startTime = time.perf_counter()
+
+		try:
+			import pyarrow.csv
+		except ImportError: # Read with csv.reader without it
+			pyarrow = None
+
+		with open(path, 'r') as csvfile:
+			fieldnames = next(csv.reader(csvfile), None)
+
+		if fieldnames is None or len(set(fieldnames)) != len(fieldnames):
+			columns = None
+		elif pyarrow is not None:
+			columns = self.readEncodedColumnsArrow(path, fieldnames)
+		else:
+			columns = self.readEncodedColumns(path, fieldnames)
+
+		if columns is None:
+			self.parseFileAtPathFast(path)
+		else:
+			self.verifyColumnsVectorized(fieldnames, columns, startTime)
+
+	# Each column as its distinct values and the index of every row's value
+	# among them, or None if a row doesn't have one value per column
+	def readEncodedColumns(self, path, fieldnames):
+		import numpy
+		import pandas
+
+		with open(path, 'r') as csvfile:
+			reader = csv.reader(csvfile)
+			next(reader, None)
+			rows = [row for row in reader if row] # DictReader skips blank lines without counting them
+
+		if any(len(row) != len(fieldnames) for row in rows):
+			return None
+
+		return [pandas.factorize(numpy.array(values, dtype=object)) for values in (zip(*rows) if rows else [[]] * len(fieldnames))]
+
+	# As readEncodedColumns, with pyarrow's much faster parser. Values are read
+	# as text, exactly as csv.reader reads them from a file opened in text mode.
+	def readEncodedColumnsArrow(self, path, fieldnames):
+		import numpy
+		import pandas
+		import pyarrow.csv
+
+		names = [str(index) for index in range(len(fieldnames))]
+
+		try:
+			table = pyarrow.csv.read_csv(path,
+				read_options=pyarrow.csv.ReadOptions(skip_rows=1, column_names=names),
+				parse_options=pyarrow.csv.ParseOptions(newlines_in_values=True),
+				convert_options=pyarrow.csv.ConvertOptions(column_types={name: pyarrow.string() for name in names},
+					strings_can_be_null=False, quoted_strings_can_be_null=False))
+		except pyarrow.ArrowInvalid:
+			return None # Rows with missing or extra columns
+
+		columns = []
+
+		for name in names:
+			encoded = table.column(name).combine_chunks().dictionary_encode()
+			codes = encoded.indices.to_numpy(zero_copy_only=False).astype(numpy.int64)
+			uniques = encoded.dictionary.to_numpy(zero_copy_only=False)
+
+			# Text mode turns the line endings within quoted values into '\n'
+			if any('\r' in value for value in uniques):
+				uniqueCodes, uniques = pandas.factorize(numpy.array([value.replace('\r\n', '\n').replace('\r', '\n') for value in uniques], dtype=object))
+				codes = uniqueCodes[codes]
+
+			columns.append((codes, uniques))
+
+		return columns
+
+	# Verifies a whole file given as encoded columns: for each column, its
+	# distinct values and the index of every row's value among them. Each rule
+	# is evaluated once per distinct value and mapped onto every row, and the
+	# errors are printed in line order, each row's in the order the row engines
+	# check them, with the same messages.
+	def verifyColumnsVectorized(self, fieldnames, columns, startTime):
+		rowCount = len(columns[0][0]) if columns else 0
+
+		self.currentRowIndex = 0
+		self.headerColumnCount = 0
+
+		try:
+			if self.verifyColumns(fieldnames):
+				for rowIndex, text in self.vectorizedErrors(fieldnames, columns, rowCount):
+					self.currentRowIndex = rowIndex + 2 # 1 for header; 1 for human-readable, 1-indexed list
+					self.printError(text, dict(zip(fieldnames, (uniques[codes[rowIndex]] for codes, uniques in columns))))
+		except StopIteration as si:
+			pass # Stop verifying when exception is thrown
+
+		self.errorSink.finish()
+
+		elapsed = time.perf_counter() - startTime
+		print("Verified {} rows in {:.2f}s ({:.0f} rows/s)".format(rowCount, elapsed, rowCount / elapsed if elapsed else 0))
+
+	# Returns (row index, message) for every error, sorted by row and then by
+	# the order of the checks within a row
+	def vectorizedErrors(self, fieldnames, columns, rowCount):
+		import numpy
+
+		columnIndex = {name: index for index, name in enumerate(fieldnames)}
+		missing = (numpy.zeros(rowCount, dtype=numpy.int64), numpy.array([None], dtype=object))
+		(county, precinct, office, district, party, candidate, votes) = (columns[columnIndex[column]] if column in columnIndex else missing
+			for column in ('county', 'precinct', 'office', 'district', 'party', 'candidate', 'votes'))
+
+		candidateError = self.compileCandidateCheck()
+		partyError = self.compilePartyCheck()
+
+		checks = [
+			self.mapDistinct(self.officeOrDistrictError, office, district),
+			self.mapDistinct(candidateError, candidate),
+			self.mapDistinct(partyError, candidate, party) if partyError else None,
+			self.mapDistinct(self.votesError, votes),
+			self.duplicateErrors((county, precinct, office, district, party, candidate), rowCount),
+		]
+
+		rowIndexes = []
+		order = []
+		messages = []
+
+		for checkIndex, errors in enumerate(checks):
+			if errors is None:
+				continue
+
+			errorRows = numpy.flatnonzero(numpy.not_equal(errors, None))
+			rowIndexes.append(errorRows)
+			order.append(numpy.full(len(errorRows), checkIndex))
+			messages.append(errors[errorRows])
+
+		rowIndexes = numpy.concatenate(rowIndexes)
+		messages = numpy.concatenate(messages)
+		sortedErrors = numpy.lexsort((numpy.concatenate(order), rowIndexes))
+
+		return zip(rowIndexes[sortedErrors].tolist(), messages[sortedErrors])
+
+	# Applies check to each distinct combination of values in the encoded
+	# columns once, and returns its result for every row as an array
+	def mapDistinct(self, check, *columns):
+		import numpy
+
+		codes, firstRows = self.distinctCodes(columns)
+		results = numpy.array([check(*(uniques[valueCodes[row]] for valueCodes, uniques in columns)) for row in firstRows.tolist()], dtype=object)
+
+		return results[codes]
+
+	# Numbers each distinct combination of values in the encoded columns in
+	# order of appearance. Returns every row's number and the first row of each.
+	def distinctCodes(self, columns):
+		import numpy
+		import pandas
+
+		codes = numpy.zeros(len(columns[0][0]), dtype=numpy.int64)
+
+		for valueCodes, uniques in columns:
+			codes = pandas.factorize(codes * len(uniques) + valueCodes)[0]
+
+		# Numbered in order of appearance, a row is the first of its number
+		# when its number is higher than any before it
+		firstRow = numpy.ones(len(codes), dtype=bool)
+		firstRow[1:] = codes[1:] > numpy.maximum.accumulate(codes)[:-1]
+
+		return (codes, numpy.flatnonzero(firstRow))
+
+	def duplicateErrors(self, keyColumns, rowCount):
+		import numpy
+
+		errors = numpy.full(rowCount, None, dtype=object)
+
+		# Rows with the same key share a code; each code's first row is the original
+		codes, firstRows = self.distinctCodes(keyColumns)
+		originalRows = firstRows[codes]
+		duplicates = numpy.flatnonzero(originalRows != numpy.arange(rowCount))
+
+		errors[duplicates] = ["Line is duplicated (original line {})".format(row + 2) for row in originalRows[duplicates].tolist()]
+
+		return errors
+
+	# Verifies rows given as sequences of strings, as csv.reader would return them.
+	# The pipeline uses this to verify a converted frame without reading it back.
+	def verifyRowsFast(self, fieldnames, rows):
+		startTime = time.perf_counter()
+		rowCount = 0
+
+		self.reader = rows
+		self.currentRowIndex = 0
+		self.headerColumnCount = 0
+
+		try:
+			if self.verifyColumns(fieldnames):
+				verifyRow = self.compileRowVerifier(fieldnames)
+
+				for row in rows:
+					if not row:
+						continue # DictReader skips blank lines without counting them
+
+					rowCount += 1
+					self.currentRowIndex = rowCount + 1 # 1 for header; 1 for human-readable, 1-indexed list
+
+					verifyRow(row)
+		except StopIteration as si:
+			pass # Stop verifying when exception is thrown
+
+		if self.duplicateDetector is not None:
+			self.printErrorsWithDuplicates(fieldnames)
+
+		self.errorSink.finish()
+
+		elapsed = time.perf_counter() - startTime
+		print("Verified {} rows in {:.2f}s ({:.0f} rows/s)".format(rowCount, elapsed, rowCount / elapsed if elapsed else 0))
+
+	# Sets up the per-row checks once for the columns of this file. The returned
+	# function verifies a row given as a list of values, with the same checks,
+	# order and messages as the verify* methods called by parseFileAtPath.
+	def compileRowVerifier(self, fieldnames):
+		headerColumnCount = len(fieldnames)
+		uniqueColumnCount = len(set(fieldnames)) # DictReader collapses duplicated columns
+
+		# Columns missing from the header read as None, like missing values in a short row
+		columnIndex = {name: index for index, name in enumerate(fieldnames)} # The last duplicate wins, as with DictReader
+		(iCounty, iPrecinct, iOffice, iDistrict, iParty, iCandidate, iVotes) = (columnIndex.get(column, headerColumnCount)
+			for column in ('county', 'precinct', 'office', 'district', 'party', 'candidate', 'votes'))
+		hasAllColumns = max(iCounty, iPrecinct, iOffice, iDistrict, iParty, iCandidate, iVotes) < headerColumnCount
+
+		officeOrDistrictError = self.compileOfficeOrDistrictCheck()
+		candidateError = self.compileCandidateCheck()
+		partyError = self.compilePartyCheck()
+		votesError = self.votesError
+		columnCountError = self.columnCountError
+		uniqueRowIDs = self.uniqueRowIDs
+		duplicateDetector = self.duplicateDetector
+		printError = self.printError
+
+		def rowDict(row):
+			return self.rowDict(fieldnames, row)
+
+		def verifyRow(row):
+			rowLength = len(row)
+
+			if rowLength == headerColumnCount and hasAllColumns:
+				values = row
+			elif rowLength <= headerColumnCount:
+				values = row + [None] * (headerColumnCount + 1 - rowLength)
+			else:
+				values = row[:headerColumnCount] + [None]
+
+			error = columnCountError(uniqueColumnCount + (rowLength > headerColumnCount) - headerColumnCount)
+
+			if error:
+				printError(error, rowDict(row))
+
+			office = values[iOffice]
+			error = officeOrDistrictError(office, values[iDistrict])
+
+			if error:
+				printError(error, rowDict(row))
+
+			candidate = values[iCandidate]
+			error = candidateError(candidate)
+
+			if error:
+				printError(error, rowDict(row))
+
+			if partyError:
+				error = partyError(candidate, values[iParty])
+
+				if error:
+					printError(error, rowDict(row))
+
+			error = votesError(values[iVotes])
+
+			if error:
+				printError(error, rowDict(row))
+
+			rowTuple = (values[iCounty], values[iPrecinct], office, values[iDistrict], values[iParty], candidate)
+
+			if duplicateDetector is not None:
+				duplicateDetector.add(rowTuple, self.currentRowIndex)
+				return
+
+			originalRowIndex = uniqueRowIDs.get(rowTuple)
+
+			if originalRowIndex:
+				self.printDuplicateError(rowTuple, originalRowIndex, rowDict(row))
+			else:
+				uniqueRowIDs[rowTuple] = self.currentRowIndex
+
+		return verifyRow
+
+	# Same as the dict DictReader would have produced, for error output
+	def rowDict(self, fieldnames, row):
+		rowDict = dict(zip(fieldnames, row))
+
+		if len(fieldnames) < len(row):
+			rowDict[None] = row[len(fieldnames):]
+		elif len(fieldnames) > len(row):
+			for key in fieldnames[len(row):]:
+				rowDict[key] = None
+
+		return rowDict
+
+	def printDuplicateError(self, rowTuple, originalRowIndex, row):
+		if self.errorLog is not None:
+			# Chunks can't know about rows in other chunks; mergeChunks words the error
+			self.logError(None, row, rowTuple)
+		else:
+			self.printError("Line is duplicated (original line {})".format(originalRowIndex), row)
+
+	def chunkReader(self, chunk):
+		start, end = chunk
+
+		with open(self.path, 'rb') as csvfile:
+			csvfile.seek(start)
+			data = csvfile.read(end - start)
+
+		# Decode just as open(path, 'r') would
+		reader = csv.reader(io.TextIOWrapper(io.BytesIO(data)))
+
+		if start == 0:
+			next(reader, None) # Skip the header
+
+		return reader
+
+	# Verifies one chunk of the file, as the fast engine would, but collects its
+	# errors instead of printing them. Row indexes are relative to the chunk,
+	# and duplicates are only detected within it; mergeChunks fixes up both.
+	def verifyChunk(self, fieldnames, chunk):
+		self.errorLog = []
+		verifyRow = self.compileRowVerifier(fieldnames)
+		rowCount = 0
+
+		try:
+			for row in self.chunkReader(chunk):
+				if not row:
+					continue
+
+				rowCount += 1
+				self.currentRowIndex = rowCount + 1
+
+				verifyRow(row)
+		except StopIteration as si:
+			pass # Later rows can't hold this file's first error
+
+		return (rowCount, self.errorLog, self.uniqueRowIDs)
+
+	def fetchChunkRows(self, fieldnames, chunk, rowIndexes):
+		rowIndexes = set(rowIndexes)
+		rows = {}
+		rowCount = 0
+
+		for row in self.chunkReader(chunk):
+			if row:
+				rowCount += 1
+
+				if rowCount + 1 in rowIndexes:
+					rows[rowCount + 1] = self.rowDict(fieldnames, row)
+
+		return rows
+
+	# Prints the errors of every chunk in file order, with file line numbers.
+	# Rows that first appear in a chunk but were already seen in an earlier one
+	# are reported as duplicates here, against their original line in the file.
+	def mergeChunks(self, fieldnames, chunks, futures, executor):
+		startTime = time.perf_counter()
+		self.currentRowIndex = 0
+		self.headerColumnCount = 0
+		rowOffset = 0
+
+		try:
+			if not self.verifyColumns(fieldnames):
+				return
+
+			for chunk, future in zip(chunks, futures):
+				rowCount, errors, chunkRowIDs = future.result()
+				duplicates = []
+
+				for rowTuple, rowIndex in chunkRowIDs.items():
+					if rowTuple in self.uniqueRowIDs:
+						duplicates.append((rowIndex, rowTuple))
+					else:
+						self.uniqueRowIDs[rowTuple] = rowIndex + rowOffset
+
+				if duplicates:
+					rows = executor.submit(fetchChunkRows, self.path, fieldnames, chunk, [rowIndex for rowIndex, rowTuple in duplicates]).result()
+					errors = errors + [(rowIndex, None, rows[rowIndex], rowTuple) for rowIndex, rowTuple in duplicates]
+					errors.sort(key=lambda error: (error[0], error[1] is None)) # The duplicate check comes last in each row
+
+				for rowIndex, text, row, rowTuple in errors:
+					self.currentRowIndex = rowIndex + rowOffset
+
+					if text is None:
+						text = "Line is duplicated (original line {})".format(self.uniqueRowIDs[rowTuple])
+
+					self.printError(text, row)
+
+				rowOffset += rowCount
+		except StopIteration as si:
+			pass # Stop verifying when exception is thrown
+		finally:
+			self.uniqueRowIDs = {}
+			self.errorSink.finish()
+
+		if self.fastMode:
+			elapsed = time.perf_counter() - startTime
+			print("Verified {} rows in {:.2f}s ({:.0f} rows/s)".format(rowOffset, elapsed, rowOffset / elapsed if elapsed else 0))
+
+	# Returns a function giving the office or district error of an office and
+	# district, or None. Each distinct pair is only checked once per file.
+	def compileOfficeOrDistrictCheck(self):
+		errors = {}
+
+		def officeOrDistrictError(office, district):
+			key = (office, district)
+
+			if key not in errors:
+				errors[key] = self.officeOrDistrictError(office, district)
+
+			return errors[key]
+
+		return officeOrDistrictError
+
+	# Returns a function giving verifyCandidate's error for a candidate, or None.
+	# Each distinct candidate is only checked once per file.
+	def compileCandidateCheck(self):
+		errors = {}
+
+		def candidateError(candidate):
+			if candidate not in errors:
+				errors[candidate] = self.candidateError(candidate)
+
+			return errors[candidate]
+
+		return candidateError
+
+	# Returns verifyParty's check, or None if it's muted
+	def compilePartyCheck(self):
+		return self.partyError if self.showsPartyErrors() else None
+
 	def verifyColumns(self, columns):
 		self.headerColumnCount = len(columns)
 
@@ -174,12 +891,13 @@ class Verifier(object):
 		return Verifier.requiredColumnSet
 
 	def verifyColumnsOfRow(self, row):
-		badColumnCount = len(row) - self.headerColumnCount
+		self.printErrorIfAny(self.columnCountError(len(row) - self.headerColumnCount), row)
 
+	def columnCountError(self, badColumnCount):
 		if badColumnCount < 0:
-			self.printError("Row is missing {} column(s)".format(abs(badColumnCount)), row)
+			return "Row is missing {} column(s)".format(abs(badColumnCount))
 		elif badColumnCount > 0:
-			self.printError("Row has {} extra column(s)".format(badColumnCount), row)
+			return "Row has {} extra column(s)".format(badColumnCount)
 
 	def verifyCounty(self, row):
 		normalisedCounty = row['county'].title()
@@ -191,51 +909,71 @@ class Verifier(object):
 			self.printError("Use title case for the county", row)
 
 	def verifyOffice(self, row):
-		if not row['office'] in Verifier.validOffices:
-			self.printError("Invalid office: {}".format(row['office']), row)
+		self.printErrorIfAny(self.officeError(row['office']), row)
+
+	def officeError(self, office):
+		if not office in Verifier.validOffices:
+			return "Invalid office: {}".format(office)
 
 	def verifyDistrict(self, row):
-		if row['office'] in Verifier.officesWithDistricts:
-			if not row['district']:
-				self.printError("Office '{}' requires a district".format(row['office']), row)
-			elif row['district'].lower() == 'x':
+		self.printErrorIfAny(self.districtError(row['office'], row['district']), row)
+
+	def districtError(self, office, district):
+		if office in Verifier.officesWithDistricts:
+			if not district:
+				return "Office '{}' requires a district".format(office)
+			elif district.lower() == 'x':
 				if not self.showXForDistrictError:
 					pass # Some counties use this, but we still want to make sure it's reviewed by default
 				else:
-					self.printError("District must be an integer", row)
-			elif not self.verifyInteger(row['district']):
-				self.printError("District must be an integer", row)
+					return "District must be an integer"
+			elif not (district.isdecimal() or self.verifyInteger(district)):
+				return "District must be an integer"
+
+	# An office has no district to check unless it's valid
+	def officeOrDistrictError(self, office, district):
+		return self.officeError(office) or self.districtError(office, district)
 
 	def verifyCandidate(self, row):
-		charsRE = re.compile('[^A-Za-z]+', re.UNICODE)
-		candidate = row['candidate']
-		normalizedCandidate = charsRE.sub('', candidate).lower()
+		self.printErrorIfAny(self.candidateError(row['candidate']), row)
+
+	def candidateError(self, candidate):
+		normalizedCandidate = Verifier.nonLettersRE.sub('', candidate or '').lower()
 
 		if candidate not in Verifier.pseudocandidates:
 			if normalizedCandidate in Verifier.normalizedPseudocandidates:
-				self.printError("Misspelled pseudocandidate a: '{}'".format(candidate), row)
-			else:
-				# Compare the normalized strings to determine if they match
-				for npc in Verifier.normalizedPseudocandidates:
-					if normalizedCandidate.startswith(npc[0:4]): # Only check the first 4 characters
-						self.printError("Misspelled pseudocandidate b: '{}'".format(candidate), row)
-						break
+				return "Misspelled pseudocandidate a: '{}'".format(candidate)
+			elif normalizedCandidate.startswith(Verifier.pseudocandidatePrefixes):
+				return "Misspelled pseudocandidate b: '{}'".format(candidate)
 
 	def verifyParty(self, row):
-		if self.showPartiesError:
-			if row['candidate'] not in Verifier.pseudocandidates and not row['party']:
-				self.printError("Party missing", row)
+		if self.showsPartyErrors():
+			self.printErrorIfAny(self.partyError(row['candidate'], row['party']), row)
+
+	def showsPartyErrors(self):
+		return self.showPartiesError
+
+	def partyError(self, candidate, party):
+		if candidate not in Verifier.pseudocandidates and not party:
+			return "Party missing"
 
 	def verifyVotes(self, row):
-		if not self.verifyInteger(row['votes']):
-			self.printError("Vote count must be an integer", row)
-		elif not int(row['votes']) >= 0:
-			self.printError("Vote count must be greater than or equal to zero", row)
+		self.printErrorIfAny(self.votesError(row['votes']), row)
+
+	def votesError(self, votes):
+		if votes and votes.isdecimal(): # A short row's missing votes are None
+			return None
+		elif not self.verifyInteger(votes):
+			return "Vote count must be an integer"
+		elif not int(votes) >= 0:
+			return "Vote count must be greater than or equal to zero"
 
 	def verifyRowIsUnique(self, row):
 		rowTuple = tuple(row[col] for col in Verifier.uniqueRowIDSet)
 
-		if rowTuple in self.uniqueRowIDs:
+		if self.duplicateDetector is not None:
+			self.duplicateDetector.add(rowTuple, self.currentRowIndex)
+		elif rowTuple in self.uniqueRowIDs:
 			self.printError("Line is duplicated (original line {})".format(self.uniqueRowIDs[rowTuple]), row)
 		else:
 			self.uniqueRowIDs[rowTuple] = self.currentRowIndex
@@ -243,16 +981,34 @@ class Verifier(object):
 	def verifyInteger(self, numberStr):
 		try:
 			integer = int(numberStr)
-		except ValueError as e:
+		except (ValueError, TypeError) as e: # None for a value missing from a short row
 			return False
 
 		return True
 
+	def errorRule(self, text):
+		for prefix, rule in self.errorRules:
+			if text.startswith(prefix):
+				return rule
+
+		return 'other'
+
+	def logError(self, text, row, rowTuple=None):
+		self.errorLog.append((self.currentRowIndex, text, row, rowTuple))
+
+		if self.singleErrorMode:
+			raise StopIteration("Stop after first error")
+
+	def printErrorIfAny(self, text, row):
+		if text:
+			self.printError(text, row)
+
 	def printError(self, text, row=[]):
-		print("ERROR: Line {}: {}".format(self.currentRowIndex, text))
+		if self.errorLog is not None:
+			self.logError(text, row)
+			return
 
-		if row:
-			print(row)
+		self.errorSink.error(self.errorRule(text), text, self.currentRowIndex, row)
 
 		if self.singleErrorMode:
 			raise StopIteration("Stop after first error")
@@ -262,10 +1018,12 @@ class GeneralPrecinctVerifier(Verifier):
 	pass
 
 class PrimaryPrecinctVerifier(Verifier):
-	def verifyParty(self, row):
-		if self.showPrimaryPartiesError and self.showPartiesError:
-			if not row['party']:
-				self.printError("Primary results must include a party for every row", row)
+	def showsPartyErrors(self):
+		return self.showPrimaryPartiesError and self.showPartiesError
+
+	def partyError(self, candidate, party):
+		if not party:
+			return "Primary results must include a party for every row"
 
 class SpecialPrecinctVerifier(Verifier):
 	pass
@@ -0,0 +1,34 @@
+"""
+Tests the converter's memo of normalized values
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from convert_spreadsheets_to_csv import NormalizationMemo
+
+
+def test_each_distinct_value_is_normalized_once():
+    calls = []
+
+    def split(value):
+        calls.append(value)
+        return (str(value).upper(), 'district')
+
+    column = pd.Series(['President', np.nan, 'Governor', np.nan, np.nan, 'President', np.nan, np.nan])
+    offices, districts = NormalizationMemo().map(column, 'split', split, outputs=2)
+
+    assert len(calls) == 3
+    assert offices.tolist() == ['PRESIDENT', 'NAN', 'GOVERNOR', 'NAN', 'NAN', 'PRESIDENT', 'NAN', 'NAN']
+    assert districts.tolist() == ['district'] * 8
+
+
+def test_column_of_only_missing_values():
+    mapped = NormalizationMemo().map(pd.Series([np.nan] * 3), 'same', lambda value: value)
+
+    assert mapped.dtype == float
+    assert mapped.isna().all()
@@ -0,0 +1,57 @@
+"""
+Tests the duplicate detector, with a memory budget small enough that it spills to disk
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+from duplicate_detector import DuplicateDetector
+
+
+def expected_duplicates(keys):
+    first_lines = {}
+    duplicates = []
+
+    for line, key in enumerate(keys, 1):
+        if key in first_lines:
+            duplicates.append((line, first_lines[key]))
+        else:
+            first_lines[key] = line
+
+    return duplicates
+
+
+def find_duplicates(keys, memoryBudget, tempDir):
+    detector = DuplicateDetector(memoryBudget, tempDir)
+
+    try:
+        for line, key in enumerate(keys, 1):
+            detector.add(key, line)
+
+        return detector.duplicates(), len(detector.runs)
+    finally:
+        detector.close()
+
+
+def precinct_keys(count):
+    return [('Autauga', f'Precinct {number % (count // 3)}', 'President', '', 'DEM', f'Candidate {number % 2}') for number in range(count)]
+
+
+def test_duplicates_without_spilling(tmp_path):
+    keys = precinct_keys(300)
+    duplicates, runs = find_duplicates(keys, 1024 * 1024, str(tmp_path))
+
+    assert runs == 0
+    assert duplicates == expected_duplicates(keys)
+
+
+def test_duplicates_across_spills(tmp_path):
+    # The smallest table holds 1024 slots, so 5000 keys spill several runs,
+    # and most duplicates are of keys first seen before an earlier spill
+    keys = precinct_keys(5000)
+    duplicates, runs = find_duplicates(keys, 0, str(tmp_path))
+
+    assert runs > 1
+    assert duplicates == expected_duplicates(keys)
+    assert os.listdir(tmp_path) == []
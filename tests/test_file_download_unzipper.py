@@ -0,0 +1,233 @@
+"""
+Tests the downloader against a local HTTP server that supports ETags and ranges
+"""
+
+import hashlib
+import http.server
+import io
+import json
+import os
+import sys
+import threading
+import zipfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import file_download_unzipper
+from file_download_unzipper import Manifest, download_to_folder, unzip_zip_files
+
+
+def zip_bytes(name, text):
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, 'w') as zip_file:
+        zip_file.writestr(name, text * 1000)
+
+    return data.getvalue()
+
+
+class ElectionHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves server.files (path -> (bytes, etag)), honoring If-None-Match and If-Range ranges
+
+    Every request's path, headers and status are appended to server.requests.
+    A path in server.truncated gets only half of its body before the
+    connection is closed, and ranges of a path in server.shifted start ten
+    bytes before the one asked for.
+    """
+    def do_GET(self):
+        data, etag = self.server.files[self.path]
+        status = self.respond(data, etag)
+        self.server.requests.append({'path': self.path, 'headers': dict(self.headers), 'status': status})
+
+    def respond(self, data, etag):
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return 304
+
+        range_header = self.headers.get('Range')
+        if range_header and self.headers.get('If-Range') == etag:
+            start = int(range_header[len('bytes='):-1])
+            if self.path in self.server.shifted:
+                start = max(start - 10, 0)
+
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{len(data)}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return 416
+
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{len(data) - 1}/{len(data)}')
+            self.send_header('Content-Length', str(len(data) - start))
+            self.send_header('ETag', etag)
+            self.end_headers()
+            self.wfile.write(data[start:])
+            return 206
+
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+
+        if self.path in self.server.truncated:
+            self.wfile.write(data[:len(data) // 2])
+            self.close_connection = True
+        else:
+            self.wfile.write(data)
+        return 200
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), ElectionHandler)
+    httpd.files = {'/2020-General.zip': (zip_bytes('2020-General-Autauga.csv', 'Autauga,1\n'), '"v1"')}
+    httpd.requests = []
+    httpd.truncated = set()
+    httpd.shifted = set()
+    httpd.url = f'http://127.0.0.1:{httpd.server_address[1]}/2020-General.zip'
+
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    return Manifest(str(tmp_path / 'AL' / file_download_unzipper.MANIFEST_NAME))
+
+
+def download(server, tmp_path, manifest):
+    return download_to_folder('2020-General.zip', server.url, data_dir=str(tmp_path), manifest=manifest)
+
+
+def served(server):
+    return server.files['/2020-General.zip'][0]
+
+
+def write_partial(tmp_path, manifest, server, data):
+    (tmp_path / 'AL').mkdir(exist_ok=True)
+    (tmp_path / 'AL' / '2020-General.zip.part').write_bytes(data)
+    manifest.update('2020-General.zip', partial={'url': server.url, 'etag': '"v1"', 'last_modified': None, 'size': len(served(server))})
+
+
+def test_download(server, tmp_path, manifest):
+    file_path = download(server, tmp_path, manifest)
+
+    assert open(file_path, 'rb').read() == served(server)
+    assert not os.path.exists(file_path + '.part')
+    assert [request['status'] for request in server.requests] == [200]
+
+    entry = json.load(open(manifest.path))['2020-General.zip']
+    assert entry['sha256'] == hashlib.sha256(served(server)).hexdigest()
+    assert entry['etag'] == '"v1"'
+    assert entry['partial'] is None
+
+
+def test_unchanged_file_is_not_downloaded_again(server, tmp_path, manifest):
+    download(server, tmp_path, manifest)
+    entry = manifest.get('2020-General.zip')
+    file_path = download(server, tmp_path, manifest)
+
+    assert server.requests[-1]['headers']['If-None-Match'] == '"v1"'
+    assert server.requests[-1]['status'] == 304
+    assert open(file_path, 'rb').read() == served(server)
+    assert manifest.get('2020-General.zip') == entry
+
+
+def test_partial_download_is_resumed(server, tmp_path, manifest):
+    write_partial(tmp_path, manifest, server, served(server)[:100])
+    file_path = download(server, tmp_path, manifest)
+
+    assert server.requests[-1]['headers']['Range'] == 'bytes=100-'
+    assert server.requests[-1]['status'] == 206
+    assert open(file_path, 'rb').read() == served(server)
+    assert manifest.get('2020-General.zip')['sha256'] == hashlib.sha256(served(server)).hexdigest()
+
+
+def test_partial_download_is_replaced_when_the_range_starts_elsewhere(server, tmp_path, manifest):
+    write_partial(tmp_path, manifest, server, served(server)[:100])
+    server.shifted.add('/2020-General.zip')
+    file_path = download(server, tmp_path, manifest)
+
+    assert [request['status'] for request in server.requests] == [206, 200]
+    assert 'Range' not in server.requests[-1]['headers']
+    assert open(file_path, 'rb').read() == served(server)
+    assert manifest.get('2020-General.zip')['sha256'] == hashlib.sha256(served(server)).hexdigest()
+
+
+def test_complete_partial_download_is_kept(server, tmp_path, manifest):
+    write_partial(tmp_path, manifest, server, served(server))
+    file_path = download(server, tmp_path, manifest)
+
+    assert [request['status'] for request in server.requests] == [416]
+    assert open(file_path, 'rb').read() == served(server)
+    assert not os.path.exists(file_path + '.part')
+
+    entry = manifest.get('2020-General.zip')
+    assert entry['sha256'] == hashlib.sha256(served(server)).hexdigest()
+    assert entry['etag'] == '"v1"'
+    assert entry['partial'] is None
+
+
+def test_partial_download_longer_than_the_file_is_replaced(server, tmp_path, manifest):
+    write_partial(tmp_path, manifest, server, served(server) + b'stale')
+    file_path = download(server, tmp_path, manifest)
+
+    assert [request['status'] for request in server.requests] == [416, 200]
+    assert 'Range' not in server.requests[-1]['headers']
+    assert open(file_path, 'rb').read() == served(server)
+
+
+def test_failed_download_keeps_the_manifest_entry(server, tmp_path, manifest):
+    file_path = download(server, tmp_path, manifest)
+    entry = manifest.get('2020-General.zip')
+
+    server.files['/2020-General.zip'] = (zip_bytes('2020-General-Autauga.csv', 'Autauga,2\n'), '"v2"')
+    server.truncated.add('/2020-General.zip')
+    with pytest.raises(IOError):
+        download(server, tmp_path, manifest)
+
+    assert {key: value for key, value in manifest.get('2020-General.zip').items() if key != 'partial'} == \
+        {key: value for key, value in entry.items() if key != 'partial'}
+    assert manifest.get('2020-General.zip')['partial']['etag'] == '"v2"'
+    assert hashlib.sha256(open(file_path, 'rb').read()).hexdigest() == entry['sha256']
+
+
+def test_file_not_matching_its_sha256_is_not_unzipped(server, tmp_path, manifest, capsys):
+    file_path = download(server, tmp_path, manifest)
+    with open(file_path, 'ab') as zip_file:
+        zip_file.write(b'tampered')
+
+    unzipped = unzip_zip_files(str(tmp_path / 'AL'), str(tmp_path / 'unzipped'), manifest)
+
+    assert unzipped == {}
+    assert "doesn't match the sha256" in capsys.readouterr().out
+    assert not os.path.exists(tmp_path / 'unzipped')
+
+
+def test_file_matching_its_sha256_is_unzipped(server, tmp_path, manifest):
+    file_path = download(server, tmp_path, manifest)
+    unzipped = unzip_zip_files(str(tmp_path / 'AL'), str(tmp_path / 'unzipped'), manifest)
+
+    assert unzipped == {file_path: str(tmp_path / 'unzipped' / '2020-general')}
+    assert os.listdir(tmp_path / 'unzipped' / '2020-general') == ['2020-General-Autauga.csv']
+
+
+def test_corrupt_zip_file_is_reported(tmp_path, capsys):
+    (tmp_path / '2020-General.zip').write_bytes(b'not a zip file')
+    (tmp_path / '2020-Primary.zip').write_bytes(zip_bytes('2020-Primary-Autauga.csv', 'Autauga,1\n'))
+
+    unzipped = unzip_zip_files(str(tmp_path), workers=2)
+
+    assert list(unzipped) == [str(tmp_path / '2020-Primary.zip')]
+    output = capsys.readouterr().out
+    assert f"ERROR: Can't unzip {tmp_path / '2020-General.zip'}" in output
+    assert 'Failed to unzip 1 of 2 zip file(s)' in output
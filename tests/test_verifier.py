@@ -0,0 +1,123 @@
+"""
+Tests the verifier's engines against each other on small generated files
+"""
+
+import csv
+import os
+import sys
+import tracemalloc
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+import verifier
+from verifier import Verifier, findChunkBoundaries
+
+FIELDNAMES = ['county', 'precinct', 'office', 'district', 'party', 'candidate', 'votes']
+CANDIDATES = [('President', '', 'REP', 'Donald J. Trump'), ('President', '', 'DEM', 'Joseph R. Biden'),
+              ('U.S. House', '1', 'REP', 'Jerry Carl'), ('U.S. House', '1', 'DEM', 'James Averhart')]
+
+
+def write_results(path, precincts):
+    """A clean statewide file, a row per precinct and candidate"""
+    with open(path, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(FIELDNAMES)
+
+        for precinct in range(precincts):
+            for office, district, party, candidate in CANDIDATES:
+                writer.writerow(['Mobile', f'Precinct {precinct}', office, district, party, candidate, precinct % 500])
+
+
+def write_quoted_results(path, precincts):
+    """
+    A file whose precinct names have a stray quote in an unquoted field and
+    line breaks in quoted ones, ending with a duplicate of an early row and a short row
+    """
+    with open(path, 'w', newline='') as csvfile:
+        csvfile.write(','.join(FIELDNAMES) + '\n')
+        csvfile.write('Mobile,Dauphin "Island,President,,REP,Donald J. Trump,10\n')
+
+        for precinct in range(precincts):
+            for office, district, party, candidate in CANDIDATES:
+                csvfile.write(f'Mobile,"Precinct {precinct}\nAnnex",{office},{district},{party},{candidate},{precinct}\n')
+
+        csvfile.write('Mobile,"Precinct 0\nAnnex",President,,REP,Donald J. Trump,0\n')
+        csvfile.write('Mobile,Precinct 0,President,,REP,Donald J. Trump\n')
+
+
+def output_lines(output):
+    return [line for line in output.splitlines() if not line.startswith('Verified ')]
+
+
+def verify_with_arguments(monkeypatch, capsys, *arguments):
+    monkeypatch.setattr(sys, 'argv', ['verifier.py', *arguments])
+    verifier.main()
+
+    return output_lines(capsys.readouterr().out)
+
+
+def verify(path, **options):
+    verifier = Verifier(path)
+
+    for option, value in options.items():
+        setattr(verifier, option, value)
+
+    verifier.verify()
+
+
+def peak_allocations(path, **options):
+    tracemalloc.start()
+
+    try:
+        verify(path, **options)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def test_duplicate_memory_stays_below_the_dict_check(tmp_path, capsys):
+    # Every row's key is kept by the dict check, while --duplicateMemory 1
+    # keeps a hash and a line per row in about 1MB, spilling beyond it
+    path = str(tmp_path / '20201103__al__general__precinct.csv')
+    write_results(path, 25000)
+
+    dictPeak = peak_allocations(path, fastMode=True)
+    dictOutput = capsys.readouterr().out
+    detectorPeak = peak_allocations(path, fastMode=True, duplicateMemory=1)
+    detectorOutput = capsys.readouterr().out
+
+    assert detectorPeak < dictPeak / 2
+    assert detectorOutput.splitlines()[:-1] == dictOutput.splitlines()[:-1] # Apart from the timing
+
+
+def test_chunks_end_between_records(tmp_path):
+    path = str(tmp_path / '20201103__al__general__precinct.csv')
+    write_quoted_results(path, 200)
+
+    with open(path, 'r', newline='') as csvfile:
+        rows = list(csv.reader(csvfile))
+
+    chunks = findChunkBoundaries(path, 1000)
+    chunkRows = []
+
+    for start, end in chunks:
+        with open(path, 'rb') as csvfile:
+            csvfile.seek(start)
+            chunkRows += list(csv.reader(csvfile.read(end - start).decode().splitlines(True)))
+
+    assert len(chunks) > 10
+    assert chunkRows == rows
+
+
+@pytest.mark.parametrize('engine', [[], ['--fast']])
+def test_chunked_verification_matches_serial(tmp_path, monkeypatch, capsys, engine):
+    path = str(tmp_path / '20201103__al__general__precinct.csv')
+    write_quoted_results(path, 200)
+
+    serial = verify_with_arguments(monkeypatch, capsys, *engine, path)
+    chunked = verify_with_arguments(monkeypatch, capsys, *engine, '--jobs', '2', '--chunkSize', '0.001', path)
+
+    assert chunked == serial
+    assert any('Vote count must be an integer' in line for line in serial)
+    assert any('Line is duplicated' in line for line in serial)